@@ -26,20 +26,18 @@
 """
 
 
-from PyQt6.QtGui import QColor
-from PyQt6.QtGui import QTextFormat
-
-
 class FORMAT_PROPERTIES:
     # Format property identifiers are defined on the basis of Qt properties.
     # This saves us time when we apply them during the rendering process.
-
-    BOLD = QTextFormat.Property.FontWeight
-    ITALIC = QTextFormat.Property.FontItalic
-    UNDERLINE = QTextFormat.Property.TextUnderlineStyle
-    COLOR = QTextFormat.Property.ForegroundBrush
-    BACKGROUND = QTextFormat.Property.BackgroundBrush
-    HREF = QTextFormat.Property.AnchorHref
+    # We use the raw values of the QTextFormat.Property enum so that the
+    # pipeline can use them without importing Qt.
+
+    BOLD = 0x2003  # QTextFormat.Property.FontWeight
+    ITALIC = 0x2004  # QTextFormat.Property.FontItalic
+    UNDERLINE = 0x2023  # QTextFormat.Property.TextUnderlineStyle
+    COLOR = 0x821  # QTextFormat.Property.ForegroundBrush
+    BACKGROUND = 0x820  # QTextFormat.Property.BackgroundBrush
+    HREF = 0x2031  # QTextFormat.Property.AnchorHref
     REVERSED = None
     BLINK = None
 
@@ -390,6 +388,49 @@ ANSI_COLORS_EXTENDED = {
 }
 
 
+# Colors given as RGB values, i.e. by truecolor ANSI codes, are interned, so
+# that each distinct color is always the same string object, and the color
+# caches downstream stay small. Servers that draw gradients can send a new
+# color for each character, and the table is bounded accordingly.
+
+MAX_INTERNED_COLORS = 65536
+
+_interned_colors: dict[int, str] = {}
+
+for _color in ANSI_COLORS_EXTENDED.values():
+    _interned_colors.setdefault(int(_color[1:], 16), _color)
+
+
+def intern_rgb_color(r: int, g: int, b: int) -> str:
+    """
+    Returns the #rgb name of the given color, always as the same string for the
+    same color.
+
+    >>> red = intern_rgb_color( 255, 0, 0 )
+    >>> print( red )
+    #ff0000
+    >>> intern_rgb_color( 255, 0, 0 ) is red
+    True
+
+    Colors of the 256 color table are the ones from that table:
+
+    >>> intern_rgb_color( 0xd7, 0x87, 0x5f ) is ANSI_COLORS_EXTENDED[ 173 ]
+    True
+
+    """
+
+    rgb = (r << 16) | (g << 8) | b
+    color = _interned_colors.get(rgb)
+
+    if color is None:
+        color = "#%06x" % rgb
+
+        if len(_interned_colors) < MAX_INTERNED_COLORS:
+            _interned_colors[rgb] = color
+
+    return color
+
+
 # A regex to match URLs:
 
 
@@ -448,6 +489,9 @@ def compute_closest_ansi_color(rgb):
 
     """
 
+    # Imported here so that the rest of this module doesn't require Qt.
+    from PyQt6.QtGui import QColor
+
     r, g, b, _ = QColor(rgb).getRgb()
 
     curr_index = -1
@@ -18,6 +18,7 @@
 #
 
 
+import functools
 import os
 import time
 
@@ -38,10 +39,15 @@ class PlainLogger(object):
     log_chunk_types = ChunkType.TEXT | ChunkType.FLOWCONTROL
     encoding = "utf-8"
 
-    def __init__(self, world, logfile):
+    def __init__(self, world, logfile, log_gagged=False):
         self.world = world
         self.logfile = logfile
 
+        # Gagged lines come as a single chunk with their text, which is only
+        # logged if so configured.
+        if log_gagged:
+            self.log_chunk_types = self.log_chunk_types | ChunkType.GAG
+
         self.is_logging = False
         self.buffer: list[bytes] = []
 
@@ -60,6 +66,9 @@ class PlainLogger(object):
         elif chunk == (ChunkType.FLOWCONTROL, FlowControl.LINEFEED):
             self.doLogText("\n")
 
+        elif chunk_type == ChunkType.GAG:
+            self.doLogText(payload + "\n")
+
         else:
             return
 
@@ -110,6 +119,14 @@ class PlainLogger(object):
         self.stop()
 
 
+@functools.lru_cache(maxsize=4096)
+def ansi_color_code(selector: bytes, color: str) -> bytes:
+    # Finding the closest ANSI color is costly, and gradients can use many
+    # colors, so the resulting codes are cached.
+
+    return ESC + b"[%s;5;%dm" % (selector, compute_closest_ansi_color(color))
+
+
 class AnsiFormatter:
     def __init__(self, buffer):
         self.buffer = buffer
@@ -125,12 +142,10 @@ class AnsiFormatter:
             self.buffer.append(ESC + b"[4m")
 
         elif property == FORMAT_PROPERTIES.COLOR:
-            ansi_color = compute_closest_ansi_color(value)
-            self.buffer.append(ESC + b"[38;5;%dm" % ansi_color)
+            self.buffer.append(ansi_color_code(b"38", value))
 
         elif property == FORMAT_PROPERTIES.BACKGROUND:
-            ansi_color = compute_closest_ansi_color(value)
-            self.buffer.append(ESC + b"[48;5;%dm" % ansi_color)
+            self.buffer.append(ansi_color_code(b"48", value))
 
     def clearProperty(self, property):
         if property == FORMAT_PROPERTIES.BOLD:
@@ -192,7 +207,7 @@ def create_logger_for_world(world, logfilename):
 
     loggerClass = AnsiLogger if world.settings._log._ansi else PlainLogger
 
-    logger = loggerClass(world, file)
+    logger = loggerClass(world, file, world.settings._log._gagged)
 
     world.socketpipeline.addSink(logger.logChunk, logger.log_chunk_types)
 
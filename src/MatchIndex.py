@@ -0,0 +1,280 @@
+# Copyright (c) 2007-2022 Pascal Varet <p.varet@gmail.com>
+#
+# This file is part of Spyrit.
+#
+# Spyrit is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 2 as published by the Free
+# Software Foundation.
+#
+# You should have received a copy of the GNU General Public License along with
+# Spyrit; if not, write to the Free Software Foundation, Inc., 51 Franklin St,
+# Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+#
+# MatchIndex.py
+#
+# This file holds the MatchIndex class, which finds the matches of a whole set
+# of match groups in a line of text.
+#
+# Running the regex of each pattern on each line gets costly with hundreds of
+# patterns, even though most lines match none of them. Combining the patterns
+# into one big alternation doesn't help: the regex engine then tries every
+# branch at every position of the line, and loses the fast literal search it
+# does for each pattern on its own.
+#
+# So instead, the index looks for the one thing most patterns can't match
+# without: runs of literal text, as given by the matches themselves. It
+# combines the literals of all the patterns into a single regex, shaped like a
+# trie, that finds in one scan which of them the line contains. Only the
+# patterns whose literals were all found are then run to find their actual
+# matches, along with the spans of their tokens.
+#
+# Patterns without a literal long enough to be worth looking for are simply
+# always run.
+#
+# Once a pattern of a group that gags lines matches, no further pattern is
+# run: the line is gone, and the actions of later groups won't be performed
+# on it anyway.
+#
+
+
+import re
+import time
+
+from typing import Iterator, Optional
+
+
+# How long a literal must be to be looked for. Shorter ones are found in most
+# lines anyway.
+MIN_LITERAL_LENGTH = 3
+
+# Patterns that take longer than this to run on a line, on several lines in a
+# row, get disabled, so that they don't keep freezing the application. A
+# single overrun may just be the process being busy with something else,
+# like collecting garbage.
+MATCH_TIME_BUDGET = 0.1  # s
+MAX_OVERRUNS = 3
+
+# Patterns that take longer than this on a single line get disabled right
+# away. No pause in the process lasts that long, and waiting for the pattern
+# to do it again would freeze the application for as long each time.
+MATCH_TIME_LIMIT = 10 * MATCH_TIME_BUDGET  # s
+
+
+def trie_regex(literals) -> str:
+    """
+    Returns a regex that matches the longest of the given literals found at
+    the position where it's applied.
+
+    >>> trie_regex(["bra", "brakon", "bravo", "zu!"])
+    '(?:bra(?:kon|vo)?|zu!)'
+    """
+
+    trie: dict = {}
+
+    for literal in literals:
+        node = trie
+
+        for char in literal:
+            node = node.setdefault(char, {})
+
+        node[""] = {}
+
+    def build(node) -> str:
+        branches = [
+            re.escape(char) + build(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+
+        if not branches:
+            return ""
+
+        if len(branches) == 1:
+            regex = branches[0]
+
+        else:
+            regex = "|".join(branches)
+
+        if "" in node:
+            # The optional group is greedy, so longer literals get tried
+            # first.
+            return "(?:%s)?" % regex
+
+        return regex if len(branches) == 1 else "(?:%s)" % regex
+
+    return build(trie)
+
+
+class MatchIndex:
+    def __init__(
+        self,
+        matchgroups,
+        time_budget: Optional[float] = None,
+        exempt=(),
+        time_limit: Optional[float] = None,
+    ):
+        # The (match group, match) pairs, in their original order.
+        self.entries: list = []
+
+        # The indexes of the entries to always run, and of the entries to
+        # consider when their longest literal is found. The other literals of
+        # the latter must be found too for them to run.
+        self.unscreened: list[int] = []
+        self.by_literal: dict[str, list[int]] = {}
+        self.other_literals: dict[int, list[str]] = {}
+
+        # The indexes of the entries after which matching stops, if they
+        # match.
+        self.gagging: set[int] = set()
+
+        literals: set[str] = set()
+
+        for matchgroup in matchgroups:
+            gags = matchgroup.gagsLines()
+
+            for match in matchgroup.matches:
+                if match.disabled:
+                    continue
+
+                index = len(self.entries)
+                self.entries.append((matchgroup, match))
+
+                if gags:
+                    self.gagging.add(index)
+
+                required = sorted(
+                    self.screeningLiterals(match), key=len, reverse=True
+                )
+
+                if not required:
+                    self.unscreened.append(index)
+                    continue
+
+                self.by_literal.setdefault(required[0], []).append(index)
+                literals.update(required)
+
+                if len(required) > 1:
+                    self.other_literals[index] = required[1:]
+
+        # When a literal is found, so are the literals it starts with.
+        # Literals found elsewhere in the line are found on their own.
+        self.found_with: dict[str, list[str]] = {
+            literal: [
+                literal[:length]
+                for length in range(MIN_LITERAL_LENGTH, len(literal) + 1)
+                if literal[:length] in literals
+            ]
+            for literal in literals
+        }
+
+        # The time budget and time limit of the patterns, and the indexes of
+        # the entries of the 'exempt' match groups, which never get disabled.
+        self.time_budget = (
+            MATCH_TIME_BUDGET if time_budget is None else time_budget
+        )
+        self.time_limit = (
+            MATCH_TIME_LIMIT if time_limit is None else time_limit
+        )
+        self.exempt: set[int] = set(
+            index
+            for index, (matchgroup, _) in enumerate(self.entries)
+            if matchgroup in exempt
+        )
+
+        # The (match group, match, time) of the patterns that went over their
+        # time budget too many times, or their time limit once, and got
+        # disabled.
+        self.disabled: list = []
+
+        self.scanner: Optional[re.Pattern] = None
+
+        if literals:
+            self.scanner = re.compile("(?=(%s))" % trie_regex(literals))
+
+    @staticmethod
+    def screeningLiterals(match) -> list[str]:
+        return [
+            literal
+            for literal in match.literals
+            if len(literal) >= MIN_LITERAL_LENGTH
+        ]
+
+    def candidates(self, line: str) -> list[int]:
+        # Returns the indexes of the entries that may match the line, in
+        # order.
+
+        if self.scanner is None:
+            return self.unscreened
+
+        found = set()
+
+        for literal in self.scanner.findall(line):
+            found.update(self.found_with[literal])
+
+        if not found:
+            return self.unscreened
+
+        indexes = self.unscreened[:]
+        other_literals = self.other_literals
+
+        for literal in found:
+            for index in self.by_literal.get(literal, ()):
+                others = other_literals.get(index)
+
+                if others is None or found.issuperset(others):
+                    indexes.append(index)
+
+        indexes.sort()
+
+        return indexes
+
+    def overran(self, index: int, elapsed: float) -> None:
+        # Called when the pattern of the given entry took longer than its
+        # time budget to run on a line. Disables it if that happened too many
+        # times in a row, or if it took longer than its time limit.
+
+        matchgroup, match = self.entries[index]
+
+        if index in self.exempt:
+            return
+
+        match.overruns += 1
+
+        if match.overruns >= MAX_OVERRUNS or elapsed > self.time_limit:
+            match.disabled = True
+            match.overruns = 0
+            self.disabled.append((matchgroup, match, elapsed))
+
+    def findMatches(self, line: str) -> Iterator:
+        # Yields the (match group, match result) pairs for the line, in the
+        # order of the match groups and of their patterns.
+
+        entries = self.entries
+        gagging = self.gagging
+        time_budget = self.time_budget
+        perf_counter = time.perf_counter
+
+        for index in self.candidates(line):
+            matchgroup, match = entries[index]
+
+            start = perf_counter()
+            results = match.matches(line)
+            elapsed = perf_counter() - start
+            match.stats.record(elapsed, bool(results))
+
+            if elapsed > time_budget:
+                self.overran(index, elapsed)
+
+            elif match.overruns:
+                match.overruns = 0
+
+            if not results:
+                continue
+
+            for result in results:
+                yield matchgroup, result
+
+            if index in gagging:
+                break
@@ -0,0 +1,128 @@
+# Copyright (c) 2007-2022 Pascal Varet <p.varet@gmail.com>
+#
+# This file is part of Spyrit.
+#
+# Spyrit is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 2 as published by the Free
+# Software Foundation.
+#
+# You should have received a copy of the GNU General Public License along with
+# Spyrit; if not, write to the Free Software Foundation, Inc., 51 Franklin St,
+# Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+#
+# MatchStats.py
+#
+# This file holds the MatchStats class, which records how often a match
+# pattern is run, how often it matches, and how long it takes, so that the
+# patterns that cost the most can be found.
+#
+
+
+import time
+
+from typing import Callable
+
+
+# Patterns that take longer than this to run on a line, on average, are
+# reported as slow.
+SLOW_PATTERN_TIME = 0.0001  # s
+
+
+class MatchStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.evaluations = 0
+        self.hits = 0
+        self.total_time = 0.0  # s
+        self.max_time = 0.0  # s
+
+    def record(self, elapsed: float, hit: bool) -> None:
+        self.evaluations += 1
+        self.hits += hit
+        self.total_time += elapsed
+
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    def add(self, other: "MatchStats") -> None:
+        self.evaluations += other.evaluations
+        self.hits += other.hits
+        self.total_time += other.total_time
+        self.max_time = max(self.max_time, other.max_time)
+
+    def meanTime(self) -> float:
+        if not self.evaluations:
+            return 0.0
+
+        return self.total_time / self.evaluations
+
+    def isSlow(self) -> bool:
+        return self.meanTime() > SLOW_PATTERN_TIME
+
+    def toString(self) -> str:
+        return "%d run(s), %d hit(s); %.1f ms total, %.2f ms max%s." % (
+            self.evaluations,
+            self.hits,
+            self.total_time * 1000,
+            self.max_time * 1000,
+            " (SLOW)" if self.isSlow() else "",
+        )
+
+
+# The orders in which the statistics can be reported.
+SORT_KEYS: dict[str, Callable[[MatchStats], float]] = {
+    "cost": lambda stats: stats.total_time,
+    "worst": lambda stats: stats.max_time,
+    "mean": lambda stats: stats.meanTime(),
+    "runs": lambda stats: stats.evaluations,
+    "hits": lambda stats: stats.hits,
+}
+
+
+def stats_report(matchgroups, started: float, sort: str = "cost") -> str:
+    # Returns a report of the statistics of the given match groups and of
+    # their patterns, costliest first by default.
+
+    key = SORT_KEYS[sort]
+
+    groups = []
+
+    for matchgroup in matchgroups:
+        total = MatchStats()
+
+        for match in matchgroup.matches:
+            total.add(match.stats)
+
+        groups.append((total, matchgroup))
+
+    groups.sort(key=lambda item: key(item[0]), reverse=True)
+
+    msg = []
+    msg.append(
+        "Match statistics over the last %.1fs, by %s:"
+        % (time.monotonic() - started, sort)
+    )
+
+    if not groups:
+        msg.append("  None.")
+
+    for total, matchgroup in groups:
+        msg.append("[%s] %s" % (matchgroup.name, total.toString()))
+
+        numbered = sorted(
+            enumerate(matchgroup.matches),
+            key=lambda item: key(item[1].stats),
+            reverse=True,
+        )
+
+        for i, match in numbered:
+            msg.append(
+                "  #%d: %s: %s"
+                % (i + 1, match.toString(), match.stats.toString())
+            )
+
+    return "\n".join(msg)
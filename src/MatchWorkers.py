@@ -0,0 +1,387 @@
+# Copyright (c) 2007-2022 Pascal Varet <p.varet@gmail.com>
+#
+# This file is part of Spyrit.
+#
+# Spyrit is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 2 as published by the Free
+# Software Foundation.
+#
+# You should have received a copy of the GNU General Public License along with
+# Spyrit; if not, write to the Free Software Foundation, Inc., 51 Franklin St,
+# Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+#
+# MatchWorkers.py
+#
+# This file holds the MatchWorkerPool class, which spreads the matching of a
+# batch of lines over a pool of worker processes.
+#
+# Processes rather than threads, because the re module holds the GIL while it
+# matches, so threads would take turns rather than run in parallel.
+#
+# Each worker gets a copy of the patterns of the triggers manager, and tells
+# which of them match each line of its share of the batch. Since few lines
+# match any pattern, the patterns that do are then simply run again in this
+# process, to get the actual match results that the actions work on. The
+# results come back in the order of the lines, whichever worker is done first.
+#
+# The workers time the patterns and disable the slow ones like the match index
+# does in this process, and send their statistics back along with the results.
+# Should a batch still take too long, the workers are killed, and the patterns
+# they were stuck on get disabled. The lines of their shares of the batch go
+# through unmatched: matching them in this process could freeze it just the
+# same.
+#
+
+
+import multiprocessing
+import time
+
+from multiprocessing.pool import AsyncResult, Pool
+from types import SimpleNamespace
+from typing import Any, Iterator, Optional
+
+from MatchIndex import MatchIndex
+from MatchStats import MatchStats
+
+
+# Batches smaller than this are matched in this process, as it takes less
+# time than sending them to the workers and back.
+MIN_BATCH_SIZE = 32
+
+# How long to wait for the workers to match a batch before giving up on them.
+BATCH_TIMEOUT = 1.0  # s
+
+# How long the workers may take to start. Until they have, lines are matched
+# in this process.
+START_TIMEOUT = 10.0  # s
+
+
+# The match index of the worker process.
+_worker_index: Optional[MatchIndex] = None
+
+# Shared with the main process. The index of the pattern running on each share
+# of the batch, or -1.
+_running = None
+
+
+def _init_worker(
+    matches, time_budget: float, time_limit: float, exempt, gagging, running
+) -> None:
+    global _worker_index, _running
+
+    _running = running
+
+    # The statistics come along with the patterns. Only send back those of
+    # this worker.
+    for match in matches:
+        match.stats = MatchStats()
+
+    _worker_index = MatchIndex(
+        [SimpleNamespace(matches=matches, gagsLines=lambda: False)],
+        time_budget,
+        time_limit=time_limit,
+    )
+
+    # The entries are the same as in the main process, and so are their
+    # indexes.
+    _worker_index.exempt = exempt
+    _worker_index.gagging = gagging
+
+
+def _ping(_) -> None:
+    # Does nothing, so as to tell when the workers are up.
+
+    pass
+
+
+def _match_lines(lines: list[str], share: int) -> tuple:
+    # Returns the indexes of the patterns that match each of the lines, along
+    # with the statistics of the patterns that ran, and the indexes of those
+    # that got disabled, with how long they took on their last line. 'share'
+    # is the number of the share of the batch the lines are, under which
+    # to publish the pattern that runs.
+
+    index = _worker_index
+    running = _running
+    assert index is not None and running is not None
+
+    entries = index.entries
+    time_budget = index.time_budget
+    gagging = index.gagging
+    perf_counter = time.perf_counter
+
+    hits: list[list[int]] = []
+    disabled: list[tuple[int, float]] = []
+
+    for line in lines:
+        line_hits = []
+
+        for i in index.candidates(line):
+            match = entries[i][1]
+
+            if match.disabled:
+                continue
+
+            running[share] = i
+            start = perf_counter()
+            hit = match.regex.search(line) is not None
+            elapsed = perf_counter() - start
+            match.stats.record(elapsed, hit)
+
+            if elapsed > time_budget:
+                index.overran(i, elapsed)
+
+                if match.disabled:
+                    disabled.append((i, elapsed))
+
+            elif match.overruns:
+                match.overruns = 0
+
+            if hit:
+                line_hits.append(i)
+
+                if i in gagging:
+                    break
+
+        hits.append(line_hits)
+
+    running[share] = -1
+
+    # The main process keeps the statistics. Send it those of this batch.
+    stats: dict[int, MatchStats] = {}
+
+    for i, (_, match) in enumerate(entries):
+        if match.stats.evaluations:
+            stats[i] = match.stats
+            match.stats = MatchStats()
+
+    index.disabled.clear()
+
+    return hits, stats, disabled
+
+
+class MatchWorkerPool:
+    def __init__(self, manager, workers: int):
+        self.manager = manager
+        self.workers = workers
+
+        self.pool: Optional[Pool] = None
+        self.index: Optional[MatchIndex] = None
+
+        # Becomes ready once the workers are up, which was at 'started'.
+        self.ready: Optional[AsyncResult] = None
+        self.started = 0.0
+
+        # Shared with the workers. See _running.
+        self.running: Any = None
+
+        # Set if the workers can't be used, in which case matching happens in
+        # this process, as without a pool.
+        self.broken = False
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+            self.index = None
+            self.ready = None
+            self.running = None
+
+    def startWorkers(self, index: MatchIndex) -> None:
+        # (Re)starts the workers with the patterns of the given index. They
+        # start in the background.
+
+        self.close()
+
+        # Don't fork: the parent process is a Qt application.
+        context = multiprocessing.get_context("spawn")
+
+        try:
+            self.running = context.Array("i", [-1] * self.workers, lock=False)
+            self.pool = context.Pool(
+                self.workers,
+                initializer=_init_worker,
+                initargs=(
+                    [match for _, match in index.entries],
+                    index.time_budget,
+                    index.time_limit,
+                    index.exempt,
+                    index.gagging,
+                    self.running,
+                ),
+            )
+
+        except Exception:
+            self.broken = True
+            return
+
+        self.index = index
+        self.ready = self.pool.map_async(_ping, range(self.workers), 1)
+        self.started = time.monotonic()
+
+    def workersReady(self) -> bool:
+        # Returns whether the workers are up with the current patterns, and
+        # starts them if they aren't.
+
+        if self.broken:
+            return False
+
+        index = self.manager.matchIndex()
+
+        if index is not self.index:
+            # The triggers changed since the workers were started.
+            self.startWorkers(index)
+
+        if self.ready is None:
+            return False
+
+        if not self.ready.ready():
+            if time.monotonic() - self.started > START_TIMEOUT:
+                # The workers fail to start.
+                self.broken = True
+                self.close()
+
+            return False
+
+        if not self.ready.successful():
+            self.broken = True
+            self.close()
+            return False
+
+        return True
+
+    def waitForWorkers(self) -> bool:
+        # Waits until the workers are up, or fail to start, and returns
+        # whether they are up.
+
+        if not self.workersReady() and self.ready is not None:
+            self.ready.wait(self.started + START_TIMEOUT - time.monotonic())
+
+        return self.workersReady()
+
+    def findMatches(self, lines: list[str]) -> list[tuple]:
+        # Returns the (match group, match result) pairs of each of the given
+        # lines, in the order of the lines, as TriggersManager.findMatches()
+        # would.
+
+        manager = self.manager
+
+        if len(lines) < MIN_BATCH_SIZE or not self.workersReady():
+            return [manager.findMatches(line) for line in lines]
+
+        index = self.index
+        assert self.pool is not None and index is not None
+
+        # Lines whose matches are already known don't need the workers.
+        results: list[Optional[tuple]] = [
+            manager.cachedMatches(line) for line in lines
+        ]
+        unknown = [
+            line for line, result in zip(lines, results) if result is None
+        ]
+
+        if not unknown:
+            return results  # type: ignore
+
+        # Give each worker a contiguous share of the lines.
+        size = -(-len(unknown) // self.workers)
+        batches = [unknown[i : i + size] for i in range(0, len(unknown), size)]
+        shares = [
+            self.pool.apply_async(_match_lines, (batch, n))
+            for n, batch in enumerate(batches)
+        ]
+
+        started = time.monotonic()
+
+        for share in shares:
+            share.wait(max(0.0, started + BATCH_TIMEOUT - time.monotonic()))
+
+        entries = index.entries
+        hits: list[Optional[list[int]]] = []
+        stuck = False
+
+        for n, (batch, share) in enumerate(zip(batches, shares)):
+            if not share.ready():
+                # Some pattern takes forever on some line of this share.
+                # Running it here would freeze this process, so disable it,
+                # and let the lines of the share go through unmatched.
+                stuck = True
+                hits.extend([None] * len(batch))
+
+                i = self.running[n]
+
+                if i >= 0 and i not in index.exempt:
+                    self.disablePattern(index, i, time.monotonic() - started)
+
+                continue
+
+            if not share.successful():
+                # The worker failed. Do without the workers from now on.
+                self.broken = True
+                hits.extend([None] * len(batch))
+                continue
+
+            share_hits, stats, disabled = share.get()
+            hits.extend(share_hits)
+
+            for i, match_stats in stats.items():
+                entries[i][1].stats.add(match_stats)
+
+            for i, elapsed in disabled:
+                self.disablePattern(index, i, elapsed)
+
+        if stuck or self.broken:
+            # Kill the stuck workers. They restart with the next batch.
+            self.close()
+
+        found = []
+
+        for line, indexes in zip(unknown, hits):
+            if indexes is None:
+                # The line went unmatched. Don't cache that.
+                found.append(())
+
+            else:
+                found.append(
+                    manager.cacheMatches(
+                        line, tuple(self.rematch(index, line, indexes))
+                    )
+                )
+
+        matches = iter(found)
+        results = [
+            result if result is not None else next(matches)
+            for result in results
+        ]
+
+        manager.collectDisabledMatches(index)
+
+        return results  # type: ignore
+
+    @staticmethod
+    def disablePattern(index: MatchIndex, i: int, elapsed: float) -> None:
+        # Disables the pattern of the given index entry, which took the given
+        # time on its last line, as the index does with its slow patterns.
+
+        matchgroup, match = index.entries[i]
+
+        if not match.disabled:
+            match.disabled = True
+            index.disabled.append((matchgroup, match, elapsed))
+
+    @staticmethod
+    def rematch(index: MatchIndex, line: str, indexes: list[int]) -> Iterator:
+        # Yields the (match group, match result) pairs of the patterns of the
+        # index that the workers found to match the line, up to the first
+        # that gags it.
+
+        for i in indexes:
+            matchgroup, match = index.entries[i]
+
+            for result in match.matches(line):
+                yield matchgroup, result
+
+            if i in index.gagging:
+                return
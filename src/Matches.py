@@ -22,16 +22,465 @@
 #
 # The RegexMatch provides the same interface but uses actual regexes.
 #
+# Both also tell which literal text a line must contain for them to match, so
+# that they only need to be run on the lines that do.
+#
 
 
 import abc
 import re
+import string
+
+from typing import Optional
+
+try:
+    from re import _parser  # type: ignore
+
+except ImportError:  # Python < 3.11.
+    import sre_parse as _parser  # type: ignore
+
+from MatchStats import MatchStats
 
 
 class MatchCreationError(Exception):
     pass
 
 
+def required_literals(pattern: str) -> list[str]:
+    """
+    Returns the runs of literal text without which the given regex pattern
+    can't match.
+
+    >>> required_literals(r"^(?:The|A) (\w+) arrives\.$")
+    [' ', ' arrives.']
+    >>> required_literals(r"(?:hey, )+(?P<who>\w+)(?i:foo)[!?]")
+    ['hey, ']
+    >>> required_literals(r"bar|qux")
+    []
+    """
+
+    try:
+        parsed = _parser.parse(pattern)
+
+    except (re.error, RecursionError, OverflowError):
+        return []
+
+    runs: list[str] = []
+
+    def walk(subpattern):
+        run: list[str] = []
+
+        for op, av in subpattern:
+            if op is _parser.LITERAL:
+                run.append(chr(av))
+                continue
+
+            if run:
+                runs.append("".join(run))
+                run.clear()
+
+            # The content of a plain group is as required as the group itself,
+            # and so is the content of a repeat that must occur at least once.
+            # Groups that change flags may not match their literals as is.
+
+            if op is _parser.SUBPATTERN:
+                _, add_flags, del_flags, content = av
+
+                if not add_flags and not del_flags:
+                    walk(content)
+
+            elif op is _parser.MAX_REPEAT or op is _parser.MIN_REPEAT:
+                min_count, _, content = av
+
+                if min_count >= 1:
+                    walk(content)
+
+        if run:
+            runs.append("".join(run))
+
+    walk(parsed)
+
+    return list(dict.fromkeys(runs))
+
+
+# Characters to try when checking whether two parts of a pattern can match the
+# same text.
+SAMPLE_CHARS = string.printable
+
+CATEGORY_TESTS = {
+    _parser.CATEGORY_DIGIT: lambda c: c.isdigit(),
+    _parser.CATEGORY_NOT_DIGIT: lambda c: not c.isdigit(),
+    _parser.CATEGORY_WORD: lambda c: c.isalnum() or c == "_",
+    _parser.CATEGORY_NOT_WORD: lambda c: not (c.isalnum() or c == "_"),
+    _parser.CATEGORY_SPACE: lambda c: c.isspace(),
+    _parser.CATEGORY_NOT_SPACE: lambda c: not c.isspace(),
+}
+
+REPEATS = (_parser.MAX_REPEAT, _parser.MIN_REPEAT)
+
+# The items of a parsed pattern that match a single character.
+SINGLE_CHARS = (
+    _parser.LITERAL,
+    _parser.NOT_LITERAL,
+    _parser.ANY,
+    _parser.IN,
+    _parser.CATEGORY,
+)
+
+
+def may_match_char(item, char: str) -> bool:
+    # Returns whether the given item of a parsed pattern may match the given
+    # character. Items that aren't single characters are assumed to.
+
+    op, av = item
+
+    if op is _parser.LITERAL:
+        return chr(av) == char
+
+    if op is _parser.NOT_LITERAL:
+        return chr(av) != char
+
+    if op is _parser.ANY:
+        return char != "\n"
+
+    if op is _parser.RANGE:
+        low, high = av
+        return low <= ord(char) <= high
+
+    if op is _parser.CATEGORY:
+        test = CATEGORY_TESTS.get(av)
+        return test is None or test(char)
+
+    if op is _parser.IN:
+        if av and av[0][0] is _parser.NEGATE:
+            return not any(may_match_char(i, char) for i in av[1:])
+
+        return any(may_match_char(i, char) for i in av)
+
+    return True
+
+
+def first_item(subpattern):
+    # Returns the item that matches the first character of the given parsed
+    # pattern, if there's one.
+
+    for op, av in subpattern:
+        if op is _parser.AT:
+            continue
+
+        if op is _parser.SUBPATTERN:
+            return first_item(av[3])
+
+        if op in REPEATS and av[0] >= 1:
+            return first_item(av[2])
+
+        if op in SINGLE_CHARS:
+            return (op, av)
+
+        return None
+
+    return None
+
+
+def overlap(item1, item2) -> bool:
+    # Returns whether two single-character items may match the same
+    # character. Unknown items are assumed to.
+
+    if item1 is None or item2 is None:
+        return True
+
+    return any(
+        may_match_char(item1, c) and may_match_char(item2, c)
+        for c in SAMPLE_CHARS
+    )
+
+
+# How many texts of fixed length a part of a pattern may stand for, to be
+# checked for overlapping alternatives.
+MAX_EXPANSIONS = 32
+
+
+def expansions(subpattern) -> Optional[list[tuple]]:
+    # Returns the sequences of single-character items that the given parsed
+    # pattern is a choice of, as in [a], [a, a] for a|aa, or None if it can
+    # match texts of any length, or holds other constructs.
+
+    sequences: list[tuple] = [()]
+
+    for op, av in subpattern:
+        if op in SINGLE_CHARS:
+            choices: Optional[list[tuple]] = [((op, av),)]
+
+        elif op is _parser.SUBPATTERN:
+            choices = expansions(av[3])
+
+        elif op is _parser.BRANCH:
+            choices = []
+
+            for alternative in av[1]:
+                expanded = expansions(alternative)
+
+                if expanded is None:
+                    return None
+
+                choices.extend(expanded)
+
+        elif op in REPEATS and av[1] != _parser.MAXREPEAT:
+            min_count, max_count, content = av
+            expanded = expansions(content)
+
+            if expanded is None or max_count > MAX_EXPANSIONS:
+                return None
+
+            choices = []
+            repeated: list[tuple] = [()]
+
+            for count in range(max_count + 1):
+                if count >= min_count:
+                    choices.extend(repeated)
+
+                if len(choices) > MAX_EXPANSIONS:
+                    return None
+
+                if count < max_count:
+                    repeated = [r + e for r in repeated for e in expanded]
+
+        else:
+            return None
+
+        if choices is None:
+            return None
+
+        sequences = [s + c for s in sequences for c in choices]
+
+        if len(sequences) > MAX_EXPANSIONS:
+            return None
+
+    return sequences
+
+
+def ambiguous(sequences: list[tuple]) -> bool:
+    # Returns whether some text can be split in two different ways into
+    # repetitions of the given sequences of single-character items.
+    #
+    # This follows the Sardinas-Patterson test: whenever a sequence may match
+    # the start of another, what's left of the latter has to be matched by
+    # further sequences, and so on. The text is ambiguous if both splits can
+    # end at the same place.
+
+    sequences = [s for s in sequences if s]
+
+    def fits(short, long) -> bool:
+        return all(overlap(a, b) for a, b in zip(short, long))
+
+    # The rests to match, as the sequence they're the end of, and where in it
+    # they start.
+    rests: set[tuple[int, int]] = set()
+
+    for i, first in enumerate(sequences):
+        for j, second in enumerate(sequences):
+            if i == j or len(first) > len(second) or not fits(first, second):
+                continue
+
+            if len(first) == len(second):
+                return True
+
+            rests.add((j, len(first)))
+
+    pending = list(rests)
+
+    while pending:
+        i, start = pending.pop()
+        rest = sequences[i][start:]
+
+        for j, sequence in enumerate(sequences):
+            if not fits(rest, sequence):
+                continue
+
+            if len(sequence) == len(rest):
+                return True
+
+            if len(sequence) < len(rest):
+                found = (i, start + len(sequence))
+
+            else:
+                found = (j, len(rest))
+
+            if found not in rests:
+                rests.add(found)
+                pending.append(found)
+
+    return False
+
+
+def lint_pattern(pattern: str) -> tuple[list[str], list[str]]:
+    """
+    Looks for the constructs in a regex pattern that can make the regex
+    engine backtrack for a very long time on some lines. Returns the list of
+    errors, for the constructs that can take exponential time, and the list
+    of warnings, for the ones that are merely slow.
+
+    >>> lint_pattern(r"(\w+\s?)+$")
+    (['nested repetitions, as in (a+)+'], [])
+    >>> lint_pattern(r"(?:[\w-]+\.)*\w+")
+    ([], [])
+    >>> lint_pattern(r"(a|aa)+$")
+    (['overlapping alternatives in a repetition, as in (a|aa)+'], [])
+    >>> lint_pattern(r"(?:a|ab)+c")
+    ([], [])
+    >>> lint_pattern(r"(?:ab|a$)+")
+    ([], ['overlapping alternatives in a repetition, as in (a|ab)+'])
+    >>> lint_pattern(r"(?P<a>.+?)(?P<b>.+?)!")
+    ([], ['overlapping adjacent repetitions, as in .*.*'])
+    """
+
+    errors: list[str] = []
+    warnings: list[str] = []
+
+    try:
+        parsed = _parser.parse(pattern)
+
+    except (re.error, RecursionError, OverflowError):
+        return errors, warnings
+
+    def repeats_in(subpattern):
+        # Yields the repeats within the given parsed pattern, at any depth.
+
+        for op, av in subpattern:
+            if op in REPEATS:
+                yield av
+                yield from repeats_in(av[2])
+
+            elif op is _parser.SUBPATTERN:
+                yield from repeats_in(av[3])
+
+            elif op is _parser.BRANCH:
+                for alternative in av[1]:
+                    yield from repeats_in(alternative)
+
+    def separated(content, inner) -> bool:
+        # Whether the content of a repeat holds a character, or a class of
+        # characters, that none of the inner repeats can match. Then there's
+        # only one way to split a text into repetitions of the content.
+
+        for item in content:
+            op, av = item
+
+            if op is _parser.SUBPATTERN and separated(av[3], inner):
+                return True
+
+            if op is _parser.LITERAL and not any(
+                len(repeat[2]) != 1 or may_match_char(repeat[2][0], chr(av))
+                for repeat in inner
+            ):
+                return True
+
+            if op in SINGLE_CHARS and not any(
+                len(repeat[2]) != 1 or overlap(repeat[2][0], item)
+                for repeat in inner
+            ):
+                return True
+
+        return False
+
+    def branches_in(subpattern):
+        for op, av in subpattern:
+            if op is _parser.BRANCH:
+                yield av[1]
+
+            elif op is _parser.SUBPATTERN:
+                yield from branches_in(av[3])
+
+    def single_repeat(item):
+        # Returns the content of the given item if it's an unbounded repeat of
+        # a single character, or of a group that holds only that.
+
+        op, av = item
+
+        if op is _parser.SUBPATTERN and len(av[3]) == 1:
+            op, av = av[3][0]
+
+        if op in REPEATS and av[1] == _parser.MAXREPEAT and len(av[2]) == 1:
+            return av[2][0]
+
+        return None
+
+    def check_alternatives(content):
+        # Checks the content of an unbounded repeat for alternatives that can
+        # match the same text, as there are then many ways to try to split a
+        # text into repetitions.
+
+        expanded = expansions(content)
+
+        if expanded is not None:
+            # The content only matches texts of a few fixed lengths. Check
+            # whether some text can actually be split in several ways.
+            if ambiguous(expanded):
+                errors.append(
+                    "overlapping alternatives in a repetition, as in (a|aa)+"
+                )
+
+            return
+
+        for alternatives in branches_in(content):
+            firsts = [first_item(a) for a in alternatives]
+
+            if any(
+                overlap(first, other)
+                for i, first in enumerate(firsts)
+                for other in firsts[i + 1 :]
+            ):
+                warnings.append(
+                    "overlapping alternatives in a repetition, as in (a|ab)+"
+                )
+
+    def walk(subpattern):
+        previous = None
+
+        for item in subpattern:
+            op, av = item
+
+            if op in REPEATS:
+                _, max_count, content = av
+
+                if max_count > 1:
+                    inner = [
+                        repeat
+                        for repeat in repeats_in(content)
+                        if repeat[1] > 1
+                        and _parser.MAXREPEAT in (repeat[1], max_count)
+                    ]
+
+                    if inner and not separated(content, inner):
+                        errors.append("nested repetitions, as in (a+)+")
+
+                if max_count == _parser.MAXREPEAT:
+                    check_alternatives(content)
+
+                walk(content)
+
+            elif op is _parser.SUBPATTERN:
+                walk(av[3])
+
+            elif op is _parser.BRANCH:
+                for alternative in av[1]:
+                    walk(alternative)
+
+            current = single_repeat(item)
+
+            if current is not None and previous is not None:
+                if overlap(previous, current):
+                    warnings.append(
+                        "overlapping adjacent repetitions, as in .*.*"
+                    )
+
+            previous = current
+
+    walk(parsed)
+
+    return list(dict.fromkeys(errors)), list(dict.fromkeys(warnings))
+
+
 # TODO: Add the proper methods.
 class BaseMatch(abc.ABC):
     pass
@@ -45,6 +494,18 @@ class RegexMatch(BaseMatch):
         self.regex = None
         self.error = None
         self.name = None
+        self.literals: list[str] = []
+        self.stats = MatchStats()
+
+        # Set when the pattern took too long to run on several lines in a
+        # row, or far too long on one, so that it doesn't run anymore.
+        # 'overruns' counts the lines in a row.
+        self.disabled = False
+        self.overruns = 0
+
+        # What's risky about the pattern, if anything, as found when the
+        # user created it.
+        self.warnings: list[str] = []
 
         if pattern:
             self.setPattern(pattern)
@@ -58,6 +519,12 @@ class RegexMatch(BaseMatch):
         except re.error as e:
             self.regex = re.compile("$ ^")  # Clever regex that never matches.
             self.error = "%s" % e
+            self.literals = []
+
+        else:
+            if self.regex.flags & ~re.UNICODE:
+                # Flags such as IGNORECASE change what the literals match.
+                self.literals = []
 
     def setPattern(self, pattern):
         self.pattern = pattern
@@ -67,6 +534,8 @@ class RegexMatch(BaseMatch):
 
     def patternToRegex(self, pattern):
         # This is a regex match, so the regex IS the pattern.
+        self.literals = required_literals(pattern)
+
         return pattern
 
     def matches(self, string):
@@ -136,19 +605,22 @@ class SmartMatch(RegexMatch):
     def patternToRegex(self, pattern):
         regex = []
         tokens = set()
+        literals = []
 
         while pattern:
             m = PARSER.search(pattern)
 
             if not m:
-                regex.append(self.unescape_then_escape(pattern))
+                literals.append(self.unescape(pattern))
+                regex.append(re.escape(literals[-1]))
                 break
 
             start, end = m.span(1)
             before, pattern = pattern[:start], pattern[end:]
 
             if before:
-                regex.append(self.unescape_then_escape(before))
+                literals.append(self.unescape(before))
+                regex.append(re.escape(literals[-1]))
 
             token = m.group(1).lower().lstrip("[ ").rstrip(" ]")
 
@@ -167,11 +639,13 @@ class SmartMatch(RegexMatch):
                 # Named match for any non-null string, non-greedy.
                 regex.append(r"(?P<%s>.+?)" % token)
 
+        # The text between the tokens is what the line must contain.
+        self.literals = list(dict.fromkeys(literals))
+
         return "".join(regex)
 
-    def unescape_then_escape(self, string):
-        # Unescape string according to the SmartMatch parser's rules, then
-        # re-escape according to the rules of Python's re module.
+    def unescape(self, string):
+        # Unescape string according to the SmartMatch parser's rules.
 
         replacements = (
             (r"\[", "["),
@@ -183,7 +657,7 @@ class SmartMatch(RegexMatch):
         for from_, to in replacements:
             string = string.replace(from_, to)
 
-        return re.escape(string)
+        return string
 
     def toString(self):
         return "'" + self.pattern + "'"
@@ -210,4 +684,12 @@ def load_match_by_type(pattern, type="smart"):
     if match.error:
         raise MatchCreationError("Match pattern syntax error: %s" % match.error)
 
+    errors, match.warnings = lint_pattern(match.regex.pattern)
+
+    if errors:
+        raise MatchCreationError(
+            "Match pattern rejected, as it could take forever to run on some "
+            "lines: %s" % "; ".join(errors)
+        )
+
     return match
@@ -20,15 +20,21 @@
 
 
 from Globals import FORMAT_PROPERTIES
+from Globals import MAX_INTERNED_COLORS
 
 from PyQt6.QtGui import QColor
 from PyQt6.QtGui import QFont
 
 
+# QColors are shared between all formatters. Color names are mostly interned
+# strings, so the lookups are cheap.
+
+_color_cache: dict[str, QColor] = {}
+
+
 class QTextFormatFormatter:
     def __init__(self, qtextformat):
         self.qtextformat = qtextformat
-        self.color_cache = {}
 
         self.property_setter_mapping = dict(
             (
@@ -42,11 +48,17 @@ class QTextFormatFormatter:
         )
 
     def _getCachedColor(self, value):
-        value = value.lower()
-        color = self.color_cache.get(value)
+        color = _color_cache.get(value)
 
         if color is None:
-            color = self.color_cache.setdefault(value, QColor(value))
+            name = value.lower()
+            color = _color_cache.get(name)
+
+            if color is None:
+                color = QColor(name)
+
+            if len(_color_cache) < MAX_INTERNED_COLORS:
+                _color_cache[name] = _color_cache[value] = color
 
         return color
 
@@ -129,6 +129,9 @@ WORLDS_SCHEMA = {
         ("net.ssl", {"serializer": Bool(), "default": False}),
         ("net.keepalive_seconds", {"serializer": Int(), "default": 0}),
         ("net.keepalive_packet", {"serializer": Str(), "default": "\x00"}),
+        ("net.fused_tokenizer", {"serializer": Bool(), "default": False}),
+        ("net.time_budget", {"serializer": Int(), "default": 0}),
+        ("net.trigger_workers", {"serializer": Int(), "default": 0}),
     ),
     "inherit": "..",
 }
@@ -144,6 +147,7 @@ SETTINGS_SCHEMA = {
         ("log.dir", {"serializer": Str(), "default": LOG_DIR}),
         ("log.autostart", {"serializer": Bool(), "default": False}),
         ("log.ansi", {"serializer": Bool(), "default": False}),
+        ("log.gagged", {"serializer": Bool(), "default": False}),
         ("ui.style", {"serializer": Str(), "default": False}),
         ("ui.window.min_size", {"serializer": Size(), "default": "640x480"}),
         ("ui.window.alert", {"serializer": Bool(), "default": True}),
@@ -222,6 +226,7 @@ DESCRIPTIONS = {
     "log.dir": "default log directory",
     "log.autostart": "start logging automatically on connect",
     "log.ansi": "use ANSI to log colors",
+    "log.gagged": "also log the lines hidden by gag triggers",
     "ui.view.font.name": "name of font in output window",
     "ui.view.font.size": "font size in output window",
     "ui.view.font.text_format": "format description for output window text",
@@ -237,6 +242,9 @@ DESCRIPTIONS = {
     "ui.window.alert": "animate taskbar when text is received from the server",
     "net.encoding": "server character encoding",
     "net.login_script": "arbitrary text to send on connect",
+    "net.fused_tokenizer": "parse incoming data in a single pass",
+    "net.time_budget": "max ms spent parsing between UI updates (0: no limit)",
+    "net.trigger_workers": "processes matching triggers in parallel (0: none)",
     SHORTCUTS + ".about": "shortcut: About... dialog",
     SHORTCUTS + ".aboutqt": "shortcut: About Qt... dialog",
     SHORTCUTS + ".newworld": "shortcut: New World... dialog",
@@ -20,30 +20,42 @@
 
 
 import os.path
+import time
 
 from collections import OrderedDict
+from typing import Iterator, Optional
 
-from PyQt6.QtWidgets import QApplication
-
+from MatchIndex import MatchIndex
+from MatchIndex import MATCH_TIME_BUDGET
+from MatchIndex import MATCH_TIME_LIMIT
+from MatchStats import stats_report
 from Matches import RegexMatch
 from Matches import load_match_by_type
 from Globals import URL_RE
 from Globals import FORMAT_PROPERTIES
 from Utilities import normalize_text
-from SpyritSettings import TRIGGERS, MATCHES, ACTIONS
 
 from pipeline.ChunkData import ChunkType
-from pipeline.PipeUtils import insert_chunks_in_chunk_buffer
+from pipeline.PipeUtils import apply_highlight_spans
 
-from settings import Serializers
+# Note that the modules that depend on Qt (the settings, the application) are
+# only imported where needed, so that matching can be used without Qt.
 
 
 _LINE = "__line__"
 
+# How many lines to remember the matches of. MUD output repeats itself a lot:
+# prompts, room descriptions, combat messages...
+MATCH_CACHE_SIZE = 512
+
+# The chunks that make up the displayed part of a line, which gagging removes.
+GAGGED_TYPES = ChunkType.TEXT | ChunkType.FLOWCONTROL | ChunkType.HIGHLIGHT
+
 
 class HighlightAction:
     name = "highlights"
     multiple_matches_per_line = True
+    gags_line = False
 
     @classmethod
     def factory(cls, format):
@@ -60,7 +72,7 @@ class HighlightAction:
     def __init__(self, format):
         self.highlights = format
 
-    def __call__(self, match, chunkbuffer):
+    def __call__(self, match, chunkbuffer, spans):
         for token, hl in self.highlights.items():
             if token == _LINE:
                 start, end = match.span()
@@ -74,17 +86,14 @@ class HighlightAction:
             if start == end:
                 continue
 
-            new_chunks = [
-                (start, (ChunkType.HIGHLIGHT, (id(hl), hl))),
-                (end, (ChunkType.HIGHLIGHT, (id(hl), {}))),
-            ]
-
-            insert_chunks_in_chunk_buffer(chunkbuffer, new_chunks)
+            spans.append((start, end, id(hl), hl))
 
     def params(self):
         return self.highlights
 
     def toString(self):
+        from settings import Serializers
+
         hls = []
         format = Serializers.Format()
 
@@ -108,6 +117,7 @@ class PlayAction:
     # Don't try to play several sounds at once even if several matches are
     # found.
     multiple_matches_per_line = False
+    gags_line = False
 
     @classmethod
     def factory(cls, soundfile=None):
@@ -122,7 +132,9 @@ class PlayAction:
     def __init__(self, soundfile=None):
         self.soundfile = soundfile
 
-    def __call__(self, match, chunkbuffer):
+    def __call__(self, match, chunkbuffer, spans):
+        from PyQt6.QtWidgets import QApplication
+
         core = QApplication.instance().core  # type: ignore
         core.sound.play(self.soundfile or ":/sound/pop")
 
@@ -138,10 +150,12 @@ class PlayAction:
 
 class GagAction:
     name = "gag"
-
-    # If a line is gagged, all processing stops right away.
     multiple_matches_per_line = False
 
+    # If a line is gagged, all processing stops right away: no other pattern
+    # is run on it, and no other action is performed on it.
+    gags_line = True
+
     @classmethod
     def factory(cls, enabled):
         if enabled:
@@ -149,20 +163,17 @@ class GagAction:
 
         return None, None
 
-    def __call__(self, match, chunkbuffer):
-        # TODO: (here and everywhere else): process buffer in order by adding
-        # updated chunks to a new buffer and then substituting buffer contents
-        # in-place.
-        for i in reversed(range(len(chunkbuffer))):
-            chunk = chunkbuffer[i]
-            chunk_type, _ = chunk
-
-            if chunk_type in (
-                ChunkType.TEXT,
-                ChunkType.FLOWCONTROL,
-                ChunkType.HIGHLIGHT,
-            ):
-                del chunkbuffer[i]
+    def __call__(self, match, chunkbuffer, spans):
+        # Drop the line's chunks in a single pass, and leave a single chunk
+        # with its text in their stead, for the sinks that want it, like the
+        # logger.
+        chunkbuffer[:] = [
+            chunk for chunk in chunkbuffer if not chunk[0] & GAGGED_TYPES
+        ]
+        chunkbuffer.append((ChunkType.GAG, match.string))
+
+        # The highlights of the line go with it.
+        spans.clear()
 
     def params(self):
         return True
@@ -177,6 +188,7 @@ class GagAction:
 class LinkAction:
     name = "link"
     multiple_matches_per_line = True
+    gags_line = False
 
     @classmethod
     def factory(cls, url=None):
@@ -185,7 +197,7 @@ class LinkAction:
     def __init__(self, url=None):
         self.url = url
 
-    def __call__(self, match, chunkbuffer):
+    def __call__(self, match, chunkbuffer, spans):
         start, end = match.span()
 
         if start == end:
@@ -204,12 +216,7 @@ class LinkAction:
             FORMAT_PROPERTIES.UNDERLINE: True,
         }
 
-        new_chunks = [
-            (start, (ChunkType.HIGHLIGHT, (id(href), href))),
-            (end, (ChunkType.HIGHLIGHT, (id(href), {}))),
-        ]
-
-        insert_chunks_in_chunk_buffer(chunkbuffer, new_chunks)
+        spans.append((start, end, id(href), href))
 
     def params(self):
         return "" if self.url is None else self.url
@@ -222,19 +229,34 @@ class LinkAction:
 
 
 class MatchGroup:
-    def __init__(self, name):
+    def __init__(self, name, changed=None):
         self.name = name.strip()
         self.matches = []
         self.actions = OrderedDict()
 
+        # Called when the group's matches or actions change.
+        self.changed = changed
+
     def addMatch(self, match):
         self.matches.append(match)
+
+        if self.changed is not None:
+            self.changed()
+
         return self
 
     def addAction(self, action):
         self.actions[action.name] = action
+
+        # Whether the group gags lines affects which patterns get run.
+        if self.changed is not None:
+            self.changed()
+
         return self
 
+    def gagsLines(self):
+        return any(action.gags_line for action in self.actions.values())
+
     def __len__(self):
         return len(self.matches)
 
@@ -254,11 +276,34 @@ class TriggersManager:
         self.actionregistry = OrderedDict()
         self.groups = OrderedDict()
 
+        # The generation is bumped whenever the triggers change, so that what
+        # we derive from them, like the match index and the cached matches of
+        # recent lines, gets rebuilt.
+        self.generation = 0
+        self.match_index: Optional[MatchIndex] = None
+        self.match_index_generation = -1
+        self.match_cache: OrderedDict[str, tuple] = OrderedDict()
+
+        # When the statistics of the matches were last reset.
+        self.stats_started = time.monotonic()
+
+        # How long a match may take to run on a line, most of the time and
+        # at most. The built-in matches are never disabled for taking longer,
+        # since the user can't do anything about them.
+        self.time_budget = MATCH_TIME_BUDGET  # s
+        self.time_limit = MATCH_TIME_LIMIT  # s
+
+        # The (match group, match, time) of the matches that were disabled
+        # for taking too long, until they're reported.
+        self.disabled_matches: list = []
+
     def registerActionClass(self, actionname, action):
         assert actionname not in self.actionregistry
         self.actionregistry[actionname] = action
 
     def load(self, settings):
+        from SpyritSettings import TRIGGERS, MATCHES, ACTIONS
+
         def children_in_order(node):
             children = sorted(
                 [(int(k), node[k]) for k in node if k.isnumeric()]
@@ -303,7 +348,17 @@ class TriggersManager:
 
         key = normalize_text(group.strip())
 
-        return self.groups.setdefault(key, MatchGroup(group))
+        matchgroup = self.groups.get(key)
+
+        if matchgroup is None:
+            matchgroup = self.groups[key] = MatchGroup(
+                group, self.triggersChanged
+            )
+
+        return matchgroup
+
+    def triggersChanged(self):
+        self.generation += 1
 
     # TODO: Consider renaming this to loadFromArgs (for instance) and factory()
     # to loadFromSettingsNode.
@@ -337,6 +392,9 @@ class TriggersManager:
         except KeyError:
             pass
 
+        else:
+            self.triggersChanged()
+
     def delMatch(self, group, index):
         try:
             self.groups[normalize_text(group.strip())].matches.pop(index)
@@ -344,6 +402,9 @@ class TriggersManager:
         except (KeyError, IndexError):
             pass
 
+        else:
+            self.triggersChanged()
+
     def delAction(self, group, index):
         try:
             actions = self.groups[normalize_text(group.strip())].actions
@@ -354,16 +415,140 @@ class TriggersManager:
         except (KeyError, IndexError):
             pass
 
+        else:
+            self.triggersChanged()
+
+    def matchIndex(self) -> MatchIndex:
+        if self.match_index is None or (
+            self.match_index_generation != self.generation
+        ):
+            self.match_index = MatchIndex(
+                DEFAULT_MATCHES + list(self.groups.values()),
+                self.time_budget,
+                exempt=DEFAULT_MATCHES,
+                time_limit=self.time_limit,
+            )
+            self.match_index_generation = self.generation
+            self.match_cache.clear()
+
+        return self.match_index
+
+    def cachedMatches(self, line) -> Optional[tuple]:
+        # Make sure the cache is up to date with the triggers.
+        self.matchIndex()
+
+        matches = self.match_cache.get(line)
+
+        if matches is not None:
+            self.match_cache.move_to_end(line)
+
+        return matches
+
+    def cacheMatches(self, line, matches: tuple) -> tuple:
+        cache = self.match_cache
+        cache[line] = matches
+
+        if len(cache) > MATCH_CACHE_SIZE:
+            cache.popitem(last=False)
+
+        return matches
+
     def findMatches(self, line):
+        matches = self.cachedMatches(line)
+
+        if matches is None:
+            index = self.matchIndex()
+            matches = self.cacheMatches(line, tuple(index.findMatches(line)))
+            self.collectDisabledMatches(index)
+
+        return matches
+
+    def testMatches(self, line) -> Iterator:
+        # Yields the (match group, match, match result) triples for the line,
+        # of all the enabled patterns, including those that don't get to run
+        # because a previous one gags the line. Doesn't use the cache, and
+        # leaves the statistics alone.
+
         for matchgroup in DEFAULT_MATCHES + list(self.groups.values()):
             for match in matchgroup.matches:
+                if match.disabled:
+                    continue
+
                 for result in match.matches(line):
-                    yield matchgroup, result
+                    yield matchgroup, match, result
+
+    def collectDisabledMatches(self, index: MatchIndex) -> None:
+        if index.disabled:
+            # Rebuild the index without the disabled matches.
+            self.disabled_matches.extend(index.disabled)
+            index.disabled = []
+            self.triggersChanged()
+
+    def takeDisabledMatches(self):
+        disabled, self.disabled_matches = self.disabled_matches, []
+
+        return disabled
+
+    def setTimeBudget(
+        self, budget: float, limit: float = MATCH_TIME_LIMIT
+    ) -> None:
+        self.time_budget = budget
+        self.time_limit = limit
+        self.triggersChanged()
+
+    def enableMatches(self, group=None) -> int:
+        # Re-enables the disabled matches of the given group, or of all the
+        # groups, and returns how many there were.
+
+        if group is None:
+            matchgroups = list(self.groups.values())
+
+        else:
+            matchgroups = [self.groups[normalize_text(group.strip())]]
+
+        enabled = 0
+
+        for matchgroup in matchgroups:
+            for match in matchgroup.matches:
+                if match.disabled:
+                    match.disabled = False
+                    match.overruns = 0
+                    enabled += 1
+
+        if enabled:
+            self.triggersChanged()
+
+        return enabled
+
+    def statsReport(self, sort="cost"):
+        return stats_report(
+            DEFAULT_MATCHES + list(self.groups.values()),
+            self.stats_started,
+            sort,
+        )
+
+    def resetStats(self):
+        for matchgroup in DEFAULT_MATCHES + list(self.groups.values()):
+            for match in matchgroup.matches:
+                match.stats.reset()
+
+        self.stats_started = time.monotonic()
 
     def performMatchingActions(self, line, chunkbuffer):
+        self.performActions(self.findMatches(line), chunkbuffer)
+
+    def performActions(self, matches, chunkbuffer):
+        # Performs the actions of the given (match group, match result) pairs
+        # on the chunks of their line.
+
         already_performed_on_this_line = set()
 
-        for matchgroup, matchresult in self.findMatches(line):
+        # The actions record their highlights as (start, end, key, format)
+        # spans over the text of the line, which are turned into chunks once
+        # all the actions are done.
+        spans = []
+
+        for matchgroup, matchresult in matches:
             for action in matchgroup.actions.values():
                 # TODO: make this cleaner. Using the class is not nice. Ideally
                 # we'd overhaul the action serialization system and reserve the
@@ -376,12 +561,20 @@ class TriggersManager:
                     continue
                 already_performed_on_this_line.add(action_class)
 
-                action(matchresult, chunkbuffer)
+                action(matchresult, chunkbuffer, spans)
+
+                if action.gags_line:
+                    # The line is gone. Nothing left to do with it.
+                    return
+
+        apply_highlight_spans(chunkbuffer, spans)
 
     def isEmpty(self):
         return not self.groups
 
     def save(self, settings):
+        from SpyritSettings import TRIGGERS, MATCHES, ACTIONS
+
         # Configuration is about to be saved. Serialize our current setup into
         # the configuration.
 
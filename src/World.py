@@ -80,8 +80,13 @@ class World(QObject):
 
         self.status = Status.DISCONNECTED
 
-        self.socketpipeline: SocketPipeline = SocketPipeline(settings)
+        self.socketpipeline: SocketPipeline = SocketPipeline(
+            settings, app.core.triggers  # type: ignore
+        )
         self.socketpipeline.addSink(self.sink, ChunkType.NETWORK)
+        self.socketpipeline.pipeline.bindNotificationListener(
+            "match_disabled", self.info
+        )
 
     def title(self):
         settings = self.settings
@@ -75,15 +75,15 @@ class WorldUI(QSplitter):
         self.inputui.returnPressed.connect(self.outputui.pingPage)
         self.secondaryinputui.returnPressed.connect(self.outputui.pingPage)
 
-        self.world.socketpipeline.pipeline.flushBegin.connect(
+        self.world.socketpipeline.flushBegin.connect(
             self.output_manager.textcursor.beginEditBlock
         )
 
-        self.world.socketpipeline.pipeline.flushEnd.connect(
+        self.world.socketpipeline.flushEnd.connect(
             self.output_manager.textcursor.endEditBlock
         )
 
-        self.world.socketpipeline.pipeline.flushEnd.connect(
+        self.world.socketpipeline.flushEnd.connect(
             self.outputui.repaint
         )
 
@@ -247,6 +247,7 @@ class WorldUI(QSplitter):
 
     def doClose(self):
         self.world.stopLogging()
+        self.world.socketpipeline.close()
 
         self.setParent(None)  # type: ignore # actually a valid call
 
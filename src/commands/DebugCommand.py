@@ -18,6 +18,13 @@
 #
 
 import builtins
+import os
+import time
+
+from Globals import CMDCHAR
+from pipeline.CompressionFilter import CompressionFilter
+from pipeline.SessionRecord import SessionFormatError
+from pipeline.SessionRecord import read_session
 
 from .BaseCommand import BaseCommand
 
@@ -72,3 +79,117 @@ class DebugCommand(BaseCommand):
             kwargs["blocksize"] = int(blocksize)
 
         world.loadFile(**kwargs)
+
+    def cmd_pipeline(self, world, action="stats"):
+        # No docstring. This is not a user-visible subcommand.
+
+        pipeline = world.socketpipeline.pipeline
+        action = action.lower()
+
+        if action == "on":
+            pipeline.setProfiling(True)
+            world.info("Pipeline profiling enabled.")
+
+        elif action == "off":
+            pipeline.setProfiling(False)
+            world.info("Pipeline profiling disabled.")
+
+        elif action == "reset":
+            if pipeline.stats is not None:
+                pipeline.stats.reset()
+
+            pipeline.max_lag = 0.0
+            world.info("Pipeline statistics reset.")
+
+        elif action == "stats":
+            msg = []
+
+            if pipeline.stats is None:
+                msg.append(
+                    "Pipeline profiling is disabled. Enable it with: "
+                    "%sdebug pipeline on" % CMDCHAR
+                )
+
+            else:
+                msg.append(pipeline.stats.report())
+
+            msg.append(
+                "Queue: %d byte(s) pending; lag %.1f ms, %.1f ms max."
+                % (pipeline.queueDepth(), pipeline.lag, pipeline.max_lag)
+            )
+
+            compression = pipeline.findFilter(CompressionFilter)
+
+            if compression is not None:
+                msg.append(compression.report())
+
+            world.info("\n".join(msg))
+
+        else:
+            world.info("Usage: %sdebug pipeline [on|off|stats|reset]" % CMDCHAR)
+
+    def cmd_record(self, world, filename=None):
+        # No docstring. This is not a user-visible subcommand.
+
+        socketpipeline = world.socketpipeline
+
+        if not filename:
+            if socketpipeline.recorder is None:
+                world.info("Not recording.")
+
+            else:
+                filename = socketpipeline.recorder.file.name
+                world.info("Recording to %s." % filename)
+
+            return
+
+        if filename.lower() == "off":
+            socketpipeline.stopRecording()
+            world.info("Recording stopped.")
+            return
+
+        f = world.openFileOrErr(filename, "wb")
+
+        if not f:
+            return
+
+        socketpipeline.startRecording(f)
+        world.info("Recording session to %s..." % os.path.basename(filename))
+
+    def cmd_replay(self, world, filename, speed="0"):
+        # No docstring. This is not a user-visible subcommand.
+        # A speed of 1 replays the session in real time, 2 twice as fast, and
+        # so on. 0 replays it as fast as possible.
+
+        try:
+            speed = float(speed)
+
+        except ValueError:
+            world.info("Usage: %sdebug replay <file> [speed]" % CMDCHAR)
+            return
+
+        f = world.openFileOrErr(filename)
+
+        if not f:
+            return
+
+        try:
+            packets = list(read_session(f))
+
+        except SessionFormatError as e:
+            world.info("Error: %s: %s" % (os.path.basename(filename), e))
+            return
+
+        finally:
+            f.close()
+
+        world.info(
+            "Replaying %d packet(s) from %s..."
+            % (len(packets), os.path.basename(filename))
+        )
+
+        t1 = time.time()
+        replayer = world.socketpipeline.replay(packets, speed)
+
+        if replayer.isFinished():
+            world.info("Session replayed in %.2fs." % (time.time() - t1))
@@ -19,6 +19,7 @@
 
 
 from Matches import MatchCreationError
+from MatchStats import SORT_KEYS
 from .BaseCommand import BaseCommand
 
 
@@ -78,6 +79,11 @@ class MatchCommand(BaseCommand):
         mgr.findOrCreateTrigger(group).addMatch(match)
         world.info("Match added.")
 
+        for warning in match.warnings:
+            world.info(
+                "Warning: this pattern may be slow to run (%s)." % warning
+            )
+
     def cmd_del(self, world, group, number=None):
         """
         Delete a match pattern or group of match patterns.
@@ -261,7 +267,9 @@ class MatchCommand(BaseCommand):
         Test an input line against every match pattern group.
 
         Report which group matches the line, and what tokens, if any, have been
-        recognized.
+        recognized. If a group gags the line, report where the processing of
+        the line stops; the groups that match after that point are listed
+        nonetheless.
 
         Usage: %(cmd)s <line>
 
@@ -281,7 +289,7 @@ class MatchCommand(BaseCommand):
 
         mgr = world.socketpipeline.triggersmanager
 
-        matches = list(mgr.findMatches(line))
+        matches = list(mgr.testMatches(line))
 
         if not matches:
             world.info("No match found.")
@@ -290,7 +298,14 @@ class MatchCommand(BaseCommand):
         msg = []
         msg.append("Matches found:")
 
-        for matchgroup, matchresult in matches:
+        # No other pattern runs after the first one that gags the line.
+        gagging = next((m for g, m, _ in matches if g.gagsLines()), None)
+        stop = max(
+            (i for i, (_, m, _) in enumerate(matches) if m is gagging),
+            default=None,
+        )
+
+        for i, (matchgroup, _, matchresult) in enumerate(matches):
             group = matchgroup.name
             tokens = sorted(
                 (tok, value)
@@ -306,8 +321,86 @@ class MatchCommand(BaseCommand):
             else:
                 msg.append("Group '%s' matches." % group)
 
+            if i == stop:
+                msg.append(
+                    "Processing of the line stops here: group '%s' gags it."
+                    % group
+                )
+
         world.info("\n".join(msg))
 
+    def cmd_stats(self, world, sort="cost"):
+        """
+        Report how much time each match pattern group and pattern takes.
+
+        Usage: %(cmd)s [cost|worst|mean|runs|hits|reset]
+
+        For each group, and each pattern in the group, this reports how many
+        times the pattern was run on a line, how many times it matched, and
+        how long that took in total and at worst. Patterns that take long to
+        run on a line are flagged as SLOW.
+
+        Patterns only run on the lines that contain their literal text, so a
+        pattern with little of it runs more often than the others.
+
+        The report is sorted by total time ('cost') by default. It can also be
+        sorted by worst time, mean time, number of runs or number of hits.
+        'reset' resets the statistics.
+
+        Examples:
+            %(cmd)s
+            %(cmd)s worst
+
+        """
+
+        mgr = world.socketpipeline.triggersmanager
+        sort = sort.lower()
+
+        if sort == "reset":
+            mgr.resetStats()
+            world.info("Match statistics reset.")
+            return
+
+        if sort not in SORT_KEYS:
+            world.info(
+                "Unknown sort order: %s. Use one of: %s."
+                % (sort, ", ".join(SORT_KEYS))
+            )
+            return
+
+        world.info(mgr.statsReport(sort))
+
+    def cmd_enable(self, world, group=None):
+        """
+        Enable the match patterns that were disabled for being too slow.
+
+        Usage: %(cmd)s [<group>]
+
+        Patterns that take too long to run on several lines in a row, or far
+        too long on a single line, get disabled, so that they don't freeze
+        the application. This enables them again, in the given group or in
+        all the groups.
+
+        Examples:
+            %(cmd)s
+            %(cmd)s pages
+
+        """
+
+        mgr = world.socketpipeline.triggersmanager
+
+        if group is not None and not mgr.hasGroup(group):
+            world.info("No such match pattern group as '%s'!" % group)
+            return
+
+        enabled = mgr.enableMatches(group)
+
+        if enabled:
+            world.info("%d match pattern(s) enabled." % enabled)
+
+        else:
+            world.info("No disabled match pattern found.")
+
     def cmd_list(self, world):
         """
         List all match groups with their match patterns and related actions.
@@ -333,7 +426,11 @@ class MatchCommand(BaseCommand):
                 if i == 0:
                     msg.append("  Patterns:")
 
-                msg.append("    #%d: " % (i + 1) + m.toString())
+                msg.append(
+                    "    #%d: " % (i + 1)
+                    + m.toString()
+                    + (" (disabled)" if m.disabled else "")
+                )
 
             for i, a in enumerate(matchgroup.actions.values()):
                 if i == 0:
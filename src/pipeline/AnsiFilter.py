@@ -27,31 +27,102 @@ from typing import Optional, Tuple, cast
 from Globals import ANSI_COLORS_EXTENDED
 from Globals import FORMAT_PROPERTIES
 from Globals import ESC
+from Globals import intern_rgb_color
 
 from .BaseFilter import BaseFilter
-from .ChunkData import ChunkType
+from .ChunkData import ChunkType, ChunkT
 from .ChunkData import ANSI_TO_FORMAT
 
 
-class AnsiFilter(BaseFilter):
-    relevant_types = ChunkType.BYTES
-
-    # For the time being, we only catch the SGR (Set Graphics Rendition) part
-    # of the ECMA 48 specification (a.k.a. ANSI escape codes).
+# The forms of escape sequences defined by ECMA 48, indexed by the byte that
+# follows the ESC. Each entry holds:
+#
+# - A regex that matches the complete sequence. Its first group holds the
+#   parameters of SGR (Select Graphic Rendition) sequences, which are the only
+#   ones we act on. The other sequences (cursor moves, line erasing, window
+#   titles...) are meaningless in a scrollback, and are simply dropped.
+# - A regex that finds the first byte past the body of the sequence, i.e. its
+#   final byte, and the offset from the start of the sequence where the body
+#   starts. If there is no such byte yet, the sequence is unfinished, and
+#   when more data comes in, the search resumes where it stopped.
+# - Whether the sequence is terminated by ST (ESC \), in which case an ESC at
+#   the end of the data may be the start of the terminator.
+
+# Control strings (OSC, DCS, SOS, PM, APC) are terminated by ST or, commonly,
+# BEL. We only let them span printable characters, so that an unterminated one
+# doesn't swallow more than a line.
+STRING_CHARS = rb"\x08\x09\x20-\x7e\x80-\xfe"
+
+CSI_SEQUENCE = (
+    re.compile(ESC + rb"\[(?:([\d;:]*)m|[0-?]*[ -/]*[@-~])"),
+    re.compile(rb"[^\x20-\x3f]"),
+    2,
+    False,
+)
+
+STRING_SEQUENCE = (
+    re.compile(ESC + rb"[\]PX^_][" + STRING_CHARS + rb"]*(?:\x07|\x1b\\)"),
+    re.compile(rb"[^" + STRING_CHARS + rb"]"),
+    2,
+    True,
+)
+
+# ESC, intermediate bytes, final byte. I.e. ESC ( B, which selects a charset.
+NF_SEQUENCE = (
+    re.compile(ESC + rb"[ -/]+[0-~]"),
+    re.compile(rb"[^ -/]"),
+    1,
+    False,
+)
+
+# ESC and a single final byte. I.e. ESC 7, which saves the cursor position.
+SHORT_SEQUENCE = (
+    re.compile(ESC + rb"[0-~]"),
+    re.compile(rb".", re.DOTALL),
+    1,
+    False,
+)
+
+SequenceT = tuple[re.Pattern, re.Pattern, int, bool]
+
+SEQUENCES: list[Optional[SequenceT]] = [None] * 256
+
+for byte in range(0x20, 0x30):
+    SEQUENCES[byte] = NF_SEQUENCE
+
+for byte in range(0x30, 0x7F):
+    SEQUENCES[byte] = SHORT_SEQUENCE
+
+for byte in b"]PX^_":
+    SEQUENCES[byte] = STRING_SEQUENCE
+
+SEQUENCES[ord("[")] = CSI_SEQUENCE
+
+# The 8 bit CSI byte is also a continuation byte in UTF-8, so we only take it
+# as an introducer for SGR sequences, as we always did.
+CSI8b_SEQUENCE = (
+    re.compile(rb"\x9b([\d;]*)m"),
+    re.compile(rb"[^\d;]"),
+    1,
+    False,
+)
 
-    CSI8b = b"\x9b"
 
-    CSI = b"(?:" + ESC + rb"\[" + b"|" + CSI8b + b")"
+class AnsiFilter(BaseFilter):
+    relevant_types = ChunkType.BYTES
 
-    match = re.compile(CSI + rb"((?:\d+;?)*)" + b"m")
+    introducer = re.compile(rb"[\x1b\x9b]")
 
-    unfinished = re.compile(
-        b"|".join([b"(" + code + b"$)" for code in (ESC, CSI + rb"[\d;]*")])
-    )
+    # Maximum number of decoded SGR sequences kept around.
+    FORMAT_CACHE_SIZE = 256
 
     highlighted: bool
     current_colors: tuple[Optional[str], Optional[str]]
 
+    def __init__(self, context):
+        self.format_cache: dict = {}
+        super().__init__(context)
+
     def resetInternalState(self):
         # Note: this method is called by the base class's __init__, so we're
         # sure that self.highlighted and self.current_colors are defined.
@@ -67,131 +138,279 @@ class AnsiFilter(BaseFilter):
         )
 
     def processChunk(self, chunk):
-        current_colors = self.current_colors
-        highlighted = self.highlighted
-
         _, text = chunk
 
-        while text:
-            ansi = self.match.search(text)
+        start = 0  # Start of the data not yet sent downstream.
+        pos = 0
+        scanned = self.resume_scan_at  # Applies to a sequence at 0 only.
 
-            if not ansi:
-                # Done with the ANSI parsing in this chunk! Bail out.
-                break
+        while (introducer := self.introducer.search(text, pos)) is not None:
+            pos = introducer.start()
+            result = self.matchSequence(text, pos, scanned if not pos else 0)
 
-            head, text = text[: ansi.start()], text[ansi.end() :]
+            if result is None:
+                # Remaining text ends with an unfinished sequence! So we feed
+                # what remains of the raw text, if any, down the pipe, and then
+                # postpone the unfinished sequence.
 
-            if head:
-                yield (ChunkType.BYTES, head)
+                if start < pos:
+                    yield (ChunkType.BYTES, text[start:pos])
 
-            parameters = bytes(ansi.groups()[0])
+                self.postpone(
+                    (ChunkType.BYTES, text[pos:] if pos else text),
+                    scanned=len(text) - pos - 1,
+                )
+                return
 
-            if not parameters:  # ESC [ m, like ESC [ 0 m, resets the format.
-                yield (ChunkType.ANSI, {})
+            end, parameters = result
 
-                highlighted, current_colors = self.defaultColors()
+            if end == pos:
+                # Not a sequence after all. Leave that byte in the data.
+                pos += 1
                 continue
 
-            format = {}
+            if start < pos:
+                yield (ChunkType.BYTES, text[start:pos])
+
+            if parameters is not None:
+                yield from self.formatChunks(parameters)
+
+            start = pos = end
+
+        if start < len(text):
+            yield (ChunkType.BYTES, text[start:] if start else text)
+
+    def matchSequence(self, data, pos: int, scanned: int = 0):
+        # Matches the escape sequence at 'pos', which is the position of an ESC
+        # or CSI byte in 'data', and of which 'scanned' bytes were already
+        # scanned, if it was postponed. Returns None if the data ends with
+        # what might be an unfinished sequence. Otherwise, returns the end
+        # position of the sequence, which is 'pos' itself if there is no valid
+        # sequence there, along with the SGR parameters of the sequence, if
+        # it's an SGR one.
+
+        if data[pos] == 0x9B:
+            sequence = CSI8b_SEQUENCE
+
+        elif pos + 1 == len(data):
+            return None
+
+        else:
+            sequence = SEQUENCES[data[pos + 1]]
+
+            if sequence is None:
+                return pos, None
+
+        complete, body_end, offset, st_terminated = sequence
+
+        # Sequences are most often complete, so try that first. But when
+        # resuming, find the end of the body first, so as not to rescan the
+        # whole sequence as long as it's unfinished.
+
+        match = None if scanned else complete.match(data, pos)
+
+        if match is None:
+            final = body_end.search(data, pos + max(offset, scanned))
+
+            if final is None:
+                return None
+
+            match = complete.match(data, pos)
+
+        if match is not None:
+            parameters = match.group(1) if match.lastindex else None
+
+            if parameters is not None:
+                parameters = bytes(parameters)
+
+            return match.end(), parameters
+
+        if st_terminated and final.start() == len(data) - 1:
+            if data[-1] == 0x1B:  # Possibly the start of ST.
+                return None
+
+        return pos, None
 
-            list_params = parameters.split(b";")
+    def scanSequence(self, data, pos: int, scanned: int = 0):
+        # Used by tokenizers that walk the stream themselves, such as the fused
+        # tokenizer. 'pos' is the position of an ESC or CSI byte in 'data'.
+        # Returns the end position of the sequence and the chunks it produces,
+        # or None if the data ends with what might be an unfinished sequence.
 
-            while list_params:
-                param = list_params.pop(0)
+        result = self.matchSequence(data, pos, scanned)
 
-                # Special case: extended 256 color codes require special
-                # treatment.
+        if result is None:
+            return None
 
-                if len(list_params) >= 2 and param in [b"38", b"48"]:
+        end, parameters = result
+
+        if end == pos:
+            # Not an escape sequence after all. Pass that byte along as data.
+            return pos + 1, [(ChunkType.BYTES, data[pos : pos + 1])]
+
+        if parameters is None:
+            return end, ()
+
+        return end, self.formatChunks(parameters)
+
+    def formatChunks(self, parameters: bytes) -> tuple[ChunkT, ...]:
+        # Returns the ANSI chunks that correspond to the given SGR parameters,
+        # and updates the current color state accordingly.
+        #
+        # The result only depends on the parameters and on the current color
+        # state, and servers use the same few sequences over and over, so it is
+        # cached. Note that the chunks are thus shared between calls, and must
+        # not be modified downstream.
+
+        key = (parameters, self.highlighted, self.current_colors)
+        cached = self.format_cache.get(key)
+
+        if cached is None:
+            cached = self.decodeParameters(parameters)
+
+            if len(self.format_cache) >= self.FORMAT_CACHE_SIZE:
+                # Evict the oldest entry.
+                del self.format_cache[next(iter(self.format_cache))]
+
+            self.format_cache[key] = cached
+
+        chunks, self.highlighted, self.current_colors = cached
+
+        return chunks
+
+    def decodeParameters(
+        self, parameters: bytes
+    ) -> tuple[
+        tuple[ChunkT, ...], bool, tuple[Optional[str], Optional[str]]
+    ]:
+        # Computes the ANSI chunks that correspond to the given SGR parameters,
+        # and the color state that results from them, starting from the
+        # current color state.
+
+        if not parameters:  # ESC [ m, like ESC [ 0 m, resets the format.
+            highlighted, current_colors = self.defaultColors()
+            return ((ChunkType.ANSI, {}),), highlighted, current_colors
+
+        current_colors = self.current_colors
+        highlighted = self.highlighted
+
+        chunks: list[ChunkT] = []
+        format = {}
+
+        list_params = parameters.split(b";")
+        count = len(list_params)
+        i = 0
+
+        while i < count:
+            param = list_params[i]
+            i += 1
+
+            # Special case: extended 256 color and truecolor codes require
+            # special treatment.
+
+            if b":" in param:
+                # ITU T.416 form, where the color values are sub-parameters,
+                # i.e. 38:5:n or 38:2::r:g:b.
+
+                subparams = param.split(b":")
+                param = subparams[0]
+
+                if param in (b"38", b"48"):
                     prop = ANSI_TO_FORMAT.get(param)[0]  # type: ignore
-                    param = list_params.pop(0)
+                    mode, values = subparams[1:2], subparams[2:]
 
-                    if param == b"5":
-                        color = ANSI_COLORS_EXTENDED.get(
-                            int(list_params.pop(0))
-                        )
-                        format[prop] = color
+                    if mode == [b"5"] and values:
+                        format[prop] = self.extendedColor(values[0])
 
-                        continue
+                    elif mode == [b"2"] and len(values) >= 3:
+                        format[prop] = self.rgbColor(*values[-3:])
 
-                # Carry on with the standard cases.
+                    continue
 
-                if param == b"0":  # ESC [ 0 m -- reset the format!
-                    yield (ChunkType.ANSI, {})
+            elif count - i >= 2 and param in (b"38", b"48"):
+                prop = ANSI_TO_FORMAT.get(param)[0]  # type: ignore
+                param = list_params[i]
+                i += 1
 
-                    highlighted, current_colors = self.defaultColors()
-                    format = {}
+                if param == b"5":
+                    format[prop] = self.extendedColor(list_params[i])
+                    i += 1
 
                     continue
 
-                if param not in ANSI_TO_FORMAT:
-                    # Unknown ANSI code. Ignore.
+                if param == b"2" and count - i >= 3:
+                    format[prop] = self.rgbColor(*list_params[i : i + 3])
+                    i += 3
+
                     continue
 
-                prop, value = ANSI_TO_FORMAT[param]  # type: ignore
+            # Carry on with the standard cases.
 
-                if prop == FORMAT_PROPERTIES.COLOR:
-                    # TODO: refactor to add proper type safety.
-                    current_colors = cast(
-                        tuple[Optional[str], Optional[str]], value
-                    )
-                    (c_unhighlighted, c_highlighted) = current_colors
+            if param == b"0":  # ESC [ 0 m -- reset the format!
+                chunks.append((ChunkType.ANSI, {}))
 
-                    if highlighted:
-                        format[FORMAT_PROPERTIES.COLOR] = c_highlighted
+                highlighted, current_colors = self.defaultColors()
+                format = {}
 
-                    else:
-                        format[FORMAT_PROPERTIES.COLOR] = c_unhighlighted
+                continue
 
-                    continue
+            if param not in ANSI_TO_FORMAT:
+                # Unknown ANSI code. Ignore.
+                continue
 
-                if prop == FORMAT_PROPERTIES.BOLD:
-                    # According to spec, this actually means highlighted colors.
+            prop, value = ANSI_TO_FORMAT[param]  # type: ignore
 
-                    highlighted = cast(bool, value)
+            if prop == FORMAT_PROPERTIES.COLOR:
+                # TODO: refactor to add proper type safety.
+                current_colors = cast(
+                    tuple[Optional[str], Optional[str]], value
+                )
+                (c_unhighlighted, c_highlighted) = current_colors
 
-                    # TODO: Clean up the property system to be type safe.
-                    current_colors = cast(Tuple[str, str], current_colors)
+                if highlighted:
+                    format[FORMAT_PROPERTIES.COLOR] = c_highlighted
 
-                    c_unhighlighted, c_highlighted = current_colors
+                else:
+                    format[FORMAT_PROPERTIES.COLOR] = c_unhighlighted
 
-                    if value:  # Colors are now highlighted.
-                        format[FORMAT_PROPERTIES.COLOR] = c_highlighted
+                continue
 
-                    else:
-                        format[FORMAT_PROPERTIES.COLOR] = c_unhighlighted
+            if prop == FORMAT_PROPERTIES.BOLD:
+                # According to spec, this actually means highlighted colors.
 
-                    if False:  # Ignore 'bold' meaning of this ANSI code?
-                        continue  # TODO: Make it a parameter.
+                highlighted = cast(bool, value)
 
-                # Other cases: italic, underline and such. Just pass the value
-                # along.
+                # TODO: Clean up the property system to be type safe.
+                current_colors = cast(Tuple[str, str], current_colors)
 
-                if prop is not None:
-                    format[prop] = cast(str, value)
+                c_unhighlighted, c_highlighted = current_colors
 
-            if format:
-                yield (ChunkType.ANSI, format)
+                if value:  # Colors are now highlighted.
+                    format[FORMAT_PROPERTIES.COLOR] = c_highlighted
 
-        # Done searching for complete ANSI sequences.
+                else:
+                    format[FORMAT_PROPERTIES.COLOR] = c_unhighlighted
 
-        self.current_colors = current_colors
-        self.highlighted = highlighted
+                if False:  # Ignore 'bold' meaning of this ANSI code?
+                    continue  # TODO: Make it a parameter.
 
-        if text:
-            possible_unfinished = self.unfinished.search(text)
+            # Other cases: italic, underline and such. Just pass the value
+            # along.
 
-            if possible_unfinished:
-                # Remaining text ends with an unfinished ANSI sequence!
-                # So we feed what remains of the raw text, if any, down the
-                # pipe, and then postpone the unfinished ANSI sequence.
+            if prop is not None:
+                format[prop] = cast(str, value)
 
-                startmatch = possible_unfinished.start()
+        if format:
+            chunks.append((ChunkType.ANSI, format))
 
-                if startmatch > 0:
-                    yield (ChunkType.BYTES, text[:startmatch])
+        return tuple(chunks), highlighted, current_colors
 
-                self.postpone((ChunkType.BYTES, text[startmatch:]))
+    @staticmethod
+    def extendedColor(index: bytes) -> Optional[str]:
+        return ANSI_COLORS_EXTENDED.get(int(index or 0))
 
-            else:
-                yield (ChunkType.BYTES, text)
+    @staticmethod
+    def rgbColor(r: bytes, g: bytes, b: bytes) -> str:
+        return intern_rgb_color(
+            min(255, int(r or 0)), min(255, int(g or 0)), min(255, int(b or 0))
+        )
@@ -33,22 +33,61 @@ class BaseFilter:
 
     relevant_types: int = ChunkType.all()
 
-    def __init__(self, context: Pipeline):
+    # Postponed data is meant for the unfinished sequences at the end of
+    # chunks, which are short. Beyond this size, it's sent downstream as is.
+
+    max_postponed_size: int = 4096
+
+    # Postponed data is usually merged with the next chunk into a new chunk.
+    # Beyond this size, it's kept in a buffer that grows in place instead, so
+    # that data that trickles in doesn't get copied over and over.
+
+    growable_postponed_size: int = 256
+
+    def __init__(self, context: Pipeline, sender=None):
         self.sink: Callable[[ChunkT], None] = lambda _: None
         self.context: Pipeline = context
+
+        # The filter on whose behalf this one sends data to the server. That's
+        # itself, unless it's only used for its logic by another filter.
+        self.sender = self if sender is None else sender
         self.postponedChunk: Optional[ChunkT] = None
+        self.postponed_scanned = 0
+
+        # How much of the chunk being processed the filter already scanned,
+        # when it starts with data postponed earlier.
+        self.resume_scan_at = 0
 
         self.resetInternalState()
 
     def setSink(self, sink: Callable[[ChunkT], None]) -> None:
         self.sink = sink
 
-    def postpone(self, chunk: ChunkT) -> None:
+    def postpone(self, chunk: ChunkT, scanned: int = 0) -> None:
+        # Keeps the given chunk, i.e. an unfinished sequence at the end of the
+        # data, to be merged with the next chunk. 'scanned' is how much of it
+        # the filter has already looked at, so that it can resume from there
+        # rather than from the start, and not end up rescanning a long
+        # sequence that trickles in again and again.
+
         if self.postponedChunk:
             raise Exception("Duplicate postponed chunk!")
 
-        else:
-            self.postponedChunk = chunk
+        chunk_type, payload = chunk
+
+        if isinstance(payload, (bytes, memoryview)):
+            if len(payload) >= self.growable_postponed_size:
+                # Large postponed data goes into a buffer that the next chunks
+                # get appended to in place.
+                chunk = (chunk_type, bytearray(payload))
+
+            elif isinstance(payload, memoryview):
+                # The payload is a window over a packet that is about to go
+                # away. Keep a copy of it instead.
+                chunk = (chunk_type, payload.tobytes())
+
+        self.postponedChunk = chunk
+        self.postponed_scanned = scanned
 
     def processChunk(self, chunk: ChunkT) -> Iterable[ChunkT]:
         # This is the default implementation, which does nothing.
@@ -70,7 +109,7 @@ class BaseFilter:
         if not self.postponedChunk:
             return chunk
 
-        chunk_type, _ = chunk
+        chunk_type, payload = chunk
 
         if chunk_type == ChunkType.PACKETBOUND:
             # This chunk type is a special case, and is never merged with other
@@ -82,9 +121,24 @@ class BaseFilter:
         self.postponedChunk = None
         # We retrieve it...
 
+        postponed_type, postponed_payload = postponed
+
+        if len(postponed_payload or "") >= self.max_postponed_size:
+            # There's no end in sight to what we postponed. Give up on it.
+            self.abandonPostponed(postponed)
+            return chunk
+
+        if postponed_type == chunk_type and isinstance(
+            postponed_payload, bytearray
+        ):
+            postponed_payload += payload
+            self.resume_scan_at = self.postponed_scanned
+            return postponed
+
         try:
             # And try to merge it with the new chunk.
             chunk = concat_chunks(postponed, chunk)
+            self.resume_scan_at = self.postponed_scanned
 
         except ChunkTypeMismatch:
             # If they're incompatible, it means the postponed chunk was really
@@ -93,10 +147,18 @@ class BaseFilter:
 
         return chunk
 
+    def abandonPostponed(self, chunk: ChunkT) -> None:
+        # Called with postponed data that grew too large to still be an
+        # unfinished sequence. By default, it's sent downstream as is.
+
+        self.sink(chunk)
+
     def feedChunk(self, chunk: ChunkT):
         chunk_type, _ = chunk
 
         if chunk_type & self.relevant_types:
+            self.resume_scan_at = 0
+
             if self.postponedChunk:
                 chunk = self.concatPostponed(chunk)
 
@@ -113,6 +175,12 @@ class BaseFilter:
         else:
             self.sink(chunk)
 
+    def close(self) -> None:
+        # Reimplement this function if the filter holds resources that must be
+        # released when the pipeline is no longer used, such as processes.
+
+        pass
+
     def formatForSending(self, data: bytes) -> bytes:
         # Reimplement this function if the filter inherently requires the data
         # sent to the world to be modified. I.e., the telnet filter would escape
@@ -120,6 +188,16 @@ class BaseFilter:
 
         return data
 
+    def send(self, data: bytes) -> None:
+        # Sends data to the server, as formatted by the filters upstream of
+        # this one only. This is for replies to the server's protocol
+        # messages, which must not be escaped.
+
+        if not self.context:
+            return
+
+        self.context.send(data, sender=self.sender)
+
     # TODO: Check if this is used anywhere. Else, delete.
     def notify(self, notification: str, *args: str) -> None:
         if not self.context:
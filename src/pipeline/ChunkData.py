@@ -39,6 +39,16 @@ class ChunkTypeMismatch(Exception):
 
 
 class ChunkType(IntEnum):
+    """
+    The types of the chunks that go through the pipeline. They are bit flags,
+    so that filters and sinks can state all the types they handle at once.
+
+    GAG chunks hold the text of a line that a trigger gagged, in place of the
+    chunks of the line. Only the sinks that handle gagged text get them, by
+    asking for that type explicitly, like the logger when it logs gagged
+    lines. A sink added without a list of types gets all the other types.
+    """
+
     NETWORK = 1 << 0
     PACKETBOUND = 1 << 1
     PROMPTSWEEP = 1 << 2
@@ -48,11 +58,16 @@ class ChunkType(IntEnum):
     FLOWCONTROL = 1 << 6
     TEXT = 1 << 7
     HIGHLIGHT = 1 << 8
+    GAG = 1 << 9
 
     @classmethod
     def all(cls):
         return sum(ct.value for ct in cls)
 
+    @classmethod
+    def allButGag(cls):
+        return cls.all() & ~cls.GAG
+
 
 ChunkT = tuple[ChunkType, Any]
 
@@ -70,6 +85,7 @@ def concat_chunks(chunk1: ChunkT, chunk2: ChunkT) -> ChunkT:
         bytes,
         str,
         bytearray,
+        memoryview,
     ):
         raise ChunkTypeMismatch(
             "Trying to concat %d chunk with %d chunk!"
@@ -157,13 +173,20 @@ class NetworkState(IntEnum):
 # Packet-related data:
 
 
+# Large packets are fed to the pipeline one block at a time. Each block starts
+# with a START boundary, and ends with an END boundary if it's the last of its
+# packet, or with a BLOCK_END boundary if more of the packet follows.
+
+
 class PacketBoundary(IntEnum):
     START = 0
     END = 1
+    BLOCK_END = 2
 
 
 thePacketStartChunk: ChunkT = (ChunkType.PACKETBOUND, PacketBoundary.START)
 thePacketEndChunk: ChunkT = (ChunkType.PACKETBOUND, PacketBoundary.END)
+theBlockEndChunk: ChunkT = (ChunkType.PACKETBOUND, PacketBoundary.BLOCK_END)
 
 
 # Prompt-sweeper chunk:
@@ -0,0 +1,181 @@
+# Copyright (c) 2007-2022 Pascal Varet <p.varet@gmail.com>
+#
+# This file is part of Spyrit.
+#
+# Spyrit is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 2 as published by the Free
+# Software Foundation.
+#
+# You should have received a copy of the GNU General Public License along with
+# Spyrit; if not, write to the Free Software Foundation, Inc., 51 Franklin St,
+# Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+#
+# CompressionFilter.py
+#
+# This file holds the CompressionFilter class, which implements the MCCP2 and
+# MCCP3 protocols: zlib compression of the data received from the server, and
+# of the data sent to it, respectively.
+#
+# The filter goes first in the pipeline, as it works on the raw stream. The
+# Telnet filter negotiates the protocols, and lets this filter know when
+# they're accepted. From then on, this filter watches the stream for the
+# IAC SB COMPRESS2 IAC SE sequence after which the server's data is
+# compressed, which may be in the middle of a packet. It still passes that
+# sequence downstream, and the Telnet filter ignores it.
+#
+
+
+import zlib
+
+from typing import Optional
+
+from Messages import messages
+
+from .BaseFilter import BaseFilter
+from .ChunkData import ChunkType
+
+
+COMPRESS2 = 86  # Telnet option for MCCP2, i.e. server side compression.
+COMPRESS3 = 87  # Telnet option for MCCP3, i.e. client side compression.
+
+IAC = b"\xff"
+START_COMPRESS2 = b"\xff\xfa" + bytes([COMPRESS2]) + b"\xff\xf0"
+
+
+class CompressionFilter(BaseFilter):
+    relevant_types = ChunkType.BYTES
+
+    def __init__(self, context):
+        super().__init__(context)
+
+        self.bindNotificationListener("mccp2_accepted", self.acceptCompression)
+        self.bindNotificationListener("mccp3_started", self.startCompression)
+
+    def resetInternalState(self):
+        self.accepted = False
+        self.decompressor: Optional[zlib._Decompress] = None
+        self.compressor: Optional[zlib._Compress] = None
+
+        # Counters, in bytes.
+        self.received_compressed = 0
+        self.received_decompressed = 0
+        self.sent_uncompressed = 0
+        self.sent_compressed = 0
+
+        super().resetInternalState()
+
+    def acceptCompression(self) -> None:
+        self.accepted = True
+
+    def startCompression(self) -> None:
+        self.compressor = zlib.compressobj()
+
+    def processChunk(self, chunk):
+        if self.decompressor is not None:
+            _, data = chunk
+            return self.decompress(data)
+
+        if not self.accepted:
+            return (chunk,)
+
+        return self.findCompressionStart(chunk)
+
+    def findCompressionStart(self, chunk):
+        _, data = chunk
+        buf = bytes(data)
+        pos = 0
+
+        while True:
+            pos = buf.find(START_COMPRESS2, pos)
+
+            if pos == -1:
+                break
+
+            # An even number of IACs before this one means that they're
+            # escaped IACs, and this one is a real one.
+            iacs = len(buf[:pos]) - len(buf[:pos].rstrip(IAC))
+
+            if iacs % 2 == 0:
+                break
+
+            pos += 1
+
+        if pos == -1:
+            # The start sequence may be split across packets. Keep any start
+            # of it for later.
+            for size in range(len(START_COMPRESS2) - 1, 0, -1):
+                if buf.endswith(START_COMPRESS2[:size]):
+                    if len(buf) > size:
+                        yield (ChunkType.BYTES, buf[:-size])
+
+                    self.postpone((ChunkType.BYTES, buf[-size:]))
+                    return
+
+            yield chunk
+            return
+
+        end = pos + len(START_COMPRESS2)
+
+        yield (ChunkType.BYTES, buf[:end])
+
+        self.decompressor = zlib.decompressobj()
+        yield from self.decompress(buf[end:])
+
+    def decompress(self, data):
+        assert self.decompressor is not None
+
+        if not data:
+            return
+
+        try:
+            text = self.decompressor.decompress(data)
+
+        except zlib.error as e:
+            messages.warn("Corrupted compressed stream: %s" % e)
+            self.decompressor = None
+            return
+
+        self.received_compressed += len(data)
+        self.received_decompressed += len(text)
+
+        if text:
+            yield (ChunkType.BYTES, text)
+
+        if self.decompressor.eof:
+            # The server ended the compressed stream. Whatever follows is not
+            # compressed, and may contain another start sequence.
+            rest = self.decompressor.unused_data
+            self.received_compressed -= len(rest)
+            self.decompressor = None
+
+            if rest:
+                yield from self.processChunk((ChunkType.BYTES, rest))
+
+    def formatForSending(self, data: bytes) -> bytes:
+        if self.compressor is None:
+            return data
+
+        self.sent_uncompressed += len(data)
+        data = self.compressor.compress(data)
+        data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.sent_compressed += len(data)
+
+        return data
+
+    def report(self) -> str:
+        msg = []
+
+        for direction, compressed, uncompressed in (
+            ("Received", self.received_compressed, self.received_decompressed),
+            ("Sent", self.sent_compressed, self.sent_uncompressed),
+        ):
+            ratio = uncompressed / compressed if compressed else 0.0
+
+            msg.append(
+                "%s %d compressed byte(s) for %d byte(s) of data (%.1fx)."
+                % (direction, compressed, uncompressed, ratio)
+            )
+
+        return "\n".join(msg)
@@ -0,0 +1,213 @@
+# Copyright (c) 2007-2022 Pascal Varet <p.varet@gmail.com>
+#
+# This file is part of Spyrit.
+#
+# Spyrit is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 2 as published by the Free
+# Software Foundation.
+#
+# You should have received a copy of the GNU General Public License along with
+# Spyrit; if not, write to the Free Software Foundation, Inc., 51 Franklin St,
+# Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+#
+# DispatchTable.py
+#
+# Implements the DispatchTable class, which holds the sinks of a pipeline,
+# sorted by chunk type, and dispatches chunks to them.
+#
+
+"""
+
+:doctest:
+
+>>> from pipeline.DispatchTable import *
+>>> from pipeline.ChunkData import ChunkType
+
+"""
+
+
+import inspect
+import time
+import types
+import weakref
+
+from typing import Any, Callable, Iterable, Optional
+
+from .ChunkData import ChunkType, ChunkT
+from .PipelineStats import PipelineStats
+
+
+# An entry holds a weak reference to the sink (or to the object it's bound to,
+# if it's a method), the function to call on that object if any, and whether
+# the sink takes the chunk as an argument. The name of the sink is kept around
+# for profiling purposes. It includes the address of the sink's object, so that
+# the sinks of different objects of the same class are told apart.
+
+SinkEntry = tuple[weakref.ReferenceType[Any], Optional[Callable], bool, str]
+
+
+def takes_one_argument(fn: Callable[..., Any]) -> bool:
+    # Returns whether the given callable takes one argument, or none at all.
+    # Raises TypeError if it can take neither.
+
+    parameters = inspect.signature(fn).parameters.values()
+
+    positional = [
+        p
+        for p in parameters
+        if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+    ]
+    required = [p for p in positional if p.default is p.empty]
+
+    if len(required) > 1:
+        raise TypeError("%r requires more than one argument" % fn)
+
+    return bool(positional) or any(
+        p.kind == p.VAR_POSITIONAL for p in parameters
+    )
+
+
+class DispatchTable:
+
+    """
+    Dispatches chunks to weakly referenced sinks, according to their type.
+
+    The lookups are done once and for all when a sink is added, so that
+    dispatching a chunk is only a matter of looping over a list.
+
+    >>> table = DispatchTable()
+
+    >>> def sink( chunk ):
+    ...   print( "Got chunk: %r" % ( chunk, ) )
+
+    >>> def ping():
+    ...   print( "Ping!" )
+
+    >>> table.add( sink, ChunkType.TEXT )
+    >>> table.add( ping, ChunkType.TEXT | ChunkType.NETWORK )
+    >>> chunks = [ ( ChunkType.TEXT, "Hello" ), ( ChunkType.NETWORK, 0 ) ]
+    >>> table.dispatch( chunks )
+    Got chunk: (<ChunkType.TEXT: 128>, 'Hello')
+    Ping!
+    Ping!
+
+    Sinks are weakly referenced, and dead references are pruned as they're
+    found:
+
+    >>> del sink
+    >>> table.dispatch( [ ( ChunkType.TEXT, "Hello again" ) ] )
+    Ping!
+    >>> len( table.sinks[ ChunkType.TEXT ] )
+    1
+
+    Errors raised inside sinks are not hidden:
+
+    >>> def broken( chunk ):
+    ...   raise TypeError( "Genuine error" )
+    >>> table.add( broken, ChunkType.NETWORK )
+    >>> table.dispatch( [ ( ChunkType.NETWORK, 0 ) ] )
+    Traceback (most recent call last):
+    ...
+    TypeError: Genuine error
+
+    """
+
+    def __init__(self):
+        self.sinks: dict[ChunkType, list[SinkEntry]] = dict(
+            (type_, []) for type_ in ChunkType
+        )
+
+    def add(self, callback: Callable[..., None], types_: int) -> None:
+        takes_chunk = takes_one_argument(callback)
+        name = getattr(callback, "__qualname__", repr(callback))
+
+        entry: SinkEntry
+
+        if isinstance(callback, types.MethodType):
+            name = "%s (at 0x%x)" % (name, id(callback.__self__))
+            entry = (
+                weakref.ref(callback.__self__),
+                callback.__func__,
+                takes_chunk,
+                name,
+            )
+
+        elif isinstance(callback, types.FunctionType):
+            name = "%s (at 0x%x)" % (name, id(callback))
+            entry = (weakref.ref(callback), None, takes_chunk, name)
+
+        else:
+            raise TypeError("%r must be a function or method" % callback)
+
+        for type_ in ChunkType:
+            if type_ & types_:
+                self.sinks[type_].append(entry)
+
+    def dispatch(self, chunks: Iterable[ChunkT]) -> None:
+        sinks = self.sinks
+        found_dead = False
+
+        for chunk in chunks:
+            for ref, fn, takes_chunk, _ in sinks[chunk[0]]:
+                target = ref()
+
+                if target is None:
+                    found_dead = True
+
+                elif fn is not None:
+                    if takes_chunk:
+                        fn(target, chunk)
+                    else:
+                        fn(target)
+
+                elif takes_chunk:
+                    target(chunk)
+
+                else:
+                    target()
+
+        if found_dead:
+            self.prune()
+
+    def dispatchProfiled(
+        self, chunks: Iterable[ChunkT], stats: PipelineStats
+    ) -> None:
+        # Same as dispatch(), only slower, as it records the time spent in each
+        # sink.
+
+        perf_counter = time.perf_counter
+        sinks = self.sinks
+        found_dead = False
+
+        for chunk in chunks:
+            for ref, fn, takes_chunk, name in sinks[chunk[0]]:
+                target = ref()
+
+                if target is None:
+                    found_dead = True
+                    continue
+
+                if fn is not None:
+                    target = types.MethodType(fn, target)
+
+                start = perf_counter()
+
+                if takes_chunk:
+                    target(chunk)
+                else:
+                    target()
+
+                sink_stats = stats.sinkStats(name)
+                sink_stats.chunks_in += 1
+                sink_stats.record(perf_counter() - start)
+
+        if found_dead:
+            self.prune()
+
+    def prune(self) -> None:
+        for type_, entries in self.sinks.items():
+            self.sinks[type_] = [
+                entry for entry in entries if entry[0]() is not None
+            ]
@@ -32,7 +32,8 @@ from .BaseFilter import BaseFilter
 class FlowControlFilter(BaseFilter):
     relevant_types = ChunkType.TEXT
 
-    match = re.compile(r"(\r|\n)")
+    match = re.compile(r"[\r\n]")
+    split = re.compile(r"([\r\n])").split
     unix_like_cr = re.compile(rb"(?<!\r)\n")
 
     chunkmapping = {
@@ -43,30 +44,29 @@ class FlowControlFilter(BaseFilter):
     def processChunk(self, chunk):
         _, text = chunk
 
-        # Expand tabs to spaces:
-        text = text.replace("\t", " " * 8)
+        if "\t" in text:
+            # Expand tabs to spaces:
+            text = text.replace("\t", " " * 8)
+            chunk = (ChunkType.TEXT, text)
 
-        while len(text) > 0:
-            fc = self.match.search(text)
+        if self.match.search(text) is None:
+            # No flow control character in this chunk.
+            return (chunk,)
 
-            if fc:
-                head = text[: fc.start()]
-                tail = text[fc.end() :]
+        # Split the text around the flow control characters in a single pass,
+        # rather than slicing off the rest of the text after each of them.
 
-                text = tail
+        chunkmapping = self.chunkmapping
+        chunks = []
 
-                if head:
-                    yield (ChunkType.TEXT, head)
+        for part in self.split(text):
+            if not part:
+                continue
 
-                yield self.chunkmapping[fc.group()]
+            fc = chunkmapping.get(part)
+            chunks.append(fc if fc is not None else (ChunkType.TEXT, part))
 
-            else:
-                # The remaining text doesn't contain any flow control character
-                # that we care about. So we quit the loop.
-                break
-
-        if text:
-            yield (ChunkType.TEXT, text)
+        return chunks
 
     def formatForSending(self, data: bytes) -> bytes:
         # Transform UNIX-like CR into telnet-like CRLF.
@@ -0,0 +1,248 @@
+# Copyright (c) 2007-2022 Pascal Varet <p.varet@gmail.com>
+#
+# This file is part of Spyrit.
+#
+# Spyrit is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 2 as published by the Free
+# Software Foundation.
+#
+# You should have received a copy of the GNU General Public License along with
+# Spyrit; if not, write to the Free Software Foundation, Inc., 51 Franklin St,
+# Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+#
+# FusedTokenizerFilter.py
+#
+# This file holds the FusedTokenizerFilter class, which can stand in for the
+# Telnet, ANSI, Unicode and flow control filters. Instead of having each of
+# those scan every block of bytes in turn, it walks the block once, and hands
+# the Telnet and ANSI sequences it comes across to the parsing logic of the
+# corresponding filters.
+#
+# The one case where a single pass doesn't do is an ANSI sequence that's
+# interrupted by a Telnet command. The chain of filters strips the command
+# before the ANSI filter gets to see the sequence, so the sequence goes
+# through. The fused tokenizer then has those filters process the data in a
+# chain until the sequence is over.
+#
+
+
+import re
+
+from typing import Iterable
+
+from .BaseFilter import BaseFilter
+from .ChunkData import ChunkType, ChunkT
+from .AnsiFilter import AnsiFilter
+from .TelnetFilter import TelnetFilter
+from .FlowControlFilter import FlowControlFilter
+from .UnicodeTextFilter import UnicodeTextFilter
+from .Pipeline import Pipeline
+
+
+IAC = 0xFF
+LF = 0x0A
+CR = 0x0D
+
+
+class FusedTokenizerFilter(BaseFilter):
+    relevant_types = ChunkType.BYTES
+
+    # The bytes that may start something other than plain text: IAC, ESC, the
+    # 8 bit CSI, and the flow control characters.
+
+    special = re.compile(rb"[\xff\x1b\x9b\r\n]")
+    find_iac = re.compile(rb"\xff")
+
+    def __init__(self, context: Pipeline, encoding: str):
+        # Those filters aren't part of the chain. We only use them for their
+        # parsing logic and to hold the parsing state: negotiated options,
+        # current colors, encoding, etc. What the Telnet parser sends to the
+        # server is sent on our behalf, so that it's only formatted by the
+        # filters upstream of this one.
+        self.telnet = TelnetFilter(context, sender=self)
+        self.ansi = AnsiFilter(context)
+        self.unicode = UnicodeTextFilter(context, encoding)
+        self.flowcontrol = FlowControlFilter(context)
+
+        # The chunks output by those filters when chained.
+        self.chained_chunks: list[ChunkT] = []
+
+        self.telnet.setSink(self.ansi.feedChunk)
+        self.ansi.setSink(self.unicode.feedChunk)
+        self.unicode.setSink(self.flowcontrol.feedChunk)
+        self.flowcontrol.setSink(self.chained_chunks.append)
+
+        super().__init__(context)
+
+    def formatForSending(self, data: bytes) -> bytes:
+        # Format the data the way the filters we stand in for would have, in
+        # the same order.
+
+        data = self.flowcontrol.formatForSending(data)
+        return self.telnet.formatForSending(data)
+
+    def resetInternalState(self):
+        self.telnet.resetInternalState()
+        self.ansi.resetInternalState()
+        self.unicode.resetInternalState()
+        self.flowcontrol.resetInternalState()
+
+        super().resetInternalState()
+
+    def processChained(self, data) -> list[ChunkT]:
+        # Has the filters we stand in for process the data in a chain, and
+        # returns the resulting chunks.
+
+        self.telnet.feedChunk((ChunkType.BYTES, data))
+
+        chunks = self.chained_chunks[:]
+        self.chained_chunks.clear()
+
+        return chunks
+
+    def abandonPostponed(self, chunk: ChunkT) -> None:
+        # What we postpone is an unfinished ANSI sequence, which holds no line
+        # break. So we can send it along as plain text.
+
+        _, data = chunk
+        text = self.unicode.decoder.decode(data)
+
+        if "\t" in text:
+            text = text.replace("\t", " " * 8)
+
+        if text:
+            self.sink((ChunkType.TEXT, text))
+
+    def processChunk(self, chunk: ChunkT) -> Iterable[ChunkT]:
+        _, data = chunk
+
+        if self.ansi.postponedChunk:
+            # An ANSI sequence interrupted by a Telnet command is still
+            # unfinished.
+            return self.processChained(data)
+
+        chunks: list[ChunkT] = []
+        text: list[str] = []
+
+        decode = self.unicode.decoder.decode
+        search = self.special.search
+        find_iac = self.find_iac.search
+
+        def flush_text():
+            line = "".join(text)
+            text.clear()
+
+            if line:
+                if "\t" in line:
+                    # Expand tabs to spaces:
+                    line = line.replace("\t", " " * 8)
+
+                chunks.append((ChunkType.TEXT, line))
+
+        def add_sequence_chunks(sequence_chunks):
+            for sequence_chunk in sequence_chunks:
+                chunk_type, payload = sequence_chunk
+
+                if chunk_type == ChunkType.BYTES:
+                    text.append(decode(payload))
+
+                else:
+                    flush_text()
+                    chunks.append(sequence_chunk)
+
+        start = 0  # Start of the plain text not yet decoded.
+        pos = 0
+        next_iac = -1  # Position of the next IAC, once looked up.
+
+        if self.telnet.isMidSequence():
+            # Finish the Telnet sequence started in an earlier block.
+            start, sequence_chunks = self.telnet.scanSequence(data, 0)
+            add_sequence_chunks(sequence_chunks)
+            pos = start
+
+        while (special := search(data, pos)) is not None:
+            pos = special.start()
+            byte = data[pos]
+
+            if byte == LF or byte == CR:
+                # Decode the flow control character along with the text before
+                # it, so that an incomplete multibyte sequence left over in the
+                # decoder is reported before the line break.
+
+                decoded = decode(data[start : pos + 1])
+
+                if decoded[-1:] in FlowControlFilter.chunkmapping:
+                    text.append(decoded[:-1])
+                    flush_text()
+                    chunks.append(FlowControlFilter.chunkmapping[decoded[-1]])
+
+                else:
+                    text.append(decoded)
+
+                start = pos = pos + 1
+                continue
+
+            if byte == IAC:
+                result = self.telnet.scanSequence(data, pos)
+
+            else:
+                # An ANSI sequence at the start of the data was postponed, and
+                # possibly partly scanned already.
+                scanned = self.resume_scan_at if pos == 0 else 0
+
+                if next_iac < pos:
+                    found = find_iac(data, pos)
+                    next_iac = found.start() if found else len(data)
+
+                if next_iac == len(data):
+                    result = self.ansi.scanSequence(data, pos, scanned)
+
+                else:
+                    # Don't let the sequence run into the Telnet command.
+                    result = self.ansi.scanSequence(
+                        memoryview(data)[:next_iac], pos, scanned
+                    )
+
+                    if result is None:
+                        # The sequence is interrupted by the Telnet command.
+                        # Leave the rest of the data to the chain.
+                        if start < pos:
+                            text.append(decode(data[start:pos]))
+
+                        flush_text()
+                        chunks.extend(self.processChained(data[pos:]))
+
+                        return chunks
+
+            if result is None:
+                # The block ends with an unfinished ANSI sequence. Keep it for
+                # later. (Unfinished Telnet sequences are kept track of by the
+                # Telnet parser itself.)
+                if start < pos:
+                    text.append(decode(data[start:pos]))
+
+                flush_text()
+                self.postpone(
+                    (ChunkType.BYTES, data[pos:] if pos else data),
+                    scanned=len(data) - pos - 1,
+                )
+
+                return chunks
+
+            end, sequence_chunks = result
+
+            if start < pos:
+                text.append(decode(data[start:pos]))
+
+            add_sequence_chunks(sequence_chunks)
+
+            start = pos = end
+
+        if start < len(data):
+            text.append(decode(data[start:]))
+
+        flush_text()
+
+        return chunks
@@ -18,45 +18,89 @@
 #
 
 
+from operator import itemgetter
+
 from .ChunkData import ChunkType
 
 
-def insert_chunks_in_chunk_buffer(chunkbuffer, new_chunks):
-    pos = 0
-    target_pos = 0
-    new_chunk = None
+def apply_highlight_spans(chunkbuffer, spans):
+    # Turns the given (start, end, key, format) highlight spans over the text
+    # of a line into highlight chunks, inserted in the line's chunk buffer at
+    # their positions in the text.
+    #
+    # This is done in a single pass over the buffer, and the text chunks only
+    # get split where a highlight starts or ends within them. Highlight
+    # chunks at the same position are kept in the order of their spans.
+
+    events = []
+
+    for start, end, key, format in spans:
+        events.append((start, (ChunkType.HIGHLIGHT, (key, format))))
+        events.append((end, (ChunkType.HIGHLIGHT, (key, {}))))
 
-    for i, chunk in enumerate(chunkbuffer):
-        if not new_chunk:  # Pop the next chunk to insert...
-            if not new_chunks:  # ... Assuming there is one, of course.
-                return
+    if not events:
+        return
 
-            target_pos, new_chunk = new_chunks.pop(0)
+    events.sort(key=itemgetter(0))
+
+    # Only the part of the buffer between the first and the last highlight
+    # gets rebuilt.
+    result = []
+    first = None
+    stop = len(chunkbuffer)
+    pos = 0
+    i = 0
+    count = len(events)
+
+    for index, chunk in enumerate(chunkbuffer):
+        if i == count:
+            stop = index
+            break
 
         chunk_type, payload = chunk
 
         if chunk_type != ChunkType.TEXT:
-            continue
+            if first is not None:
+                result.append(chunk)
 
-        if pos == target_pos:
-            chunkbuffer.insert(i, new_chunk)
-            new_chunk = None
             continue
 
-        elif target_pos - pos < len(payload):
-            split_pos = target_pos - pos
+        end = pos + len(payload)
 
-            chunkbuffer.pop(i)
-            chunkbuffer.insert(i, (ChunkType.TEXT, payload[:split_pos]))
-            chunkbuffer.insert(i + 1, new_chunk)
-            chunkbuffer.insert(i + 2, (ChunkType.TEXT, payload[split_pos:]))
+        # Note that highlights that start or end where an empty text chunk is
+        # get inserted before it.
+        if events[i][0] >= end and (payload or events[i][0] != pos):
+            if first is not None:
+                result.append(chunk)
 
-            pos += split_pos
-            new_chunk = None
+            pos = end
             continue
 
-        else:
-            pos += len(payload)
+        if first is None:
+            first = index
+
+        cut = 0
+
+        while i < count and (events[i][0] < end or events[i][0] == pos):
+            split_pos = events[i][0] - pos
+
+            if split_pos > cut:
+                result.append((ChunkType.TEXT, payload[cut:split_pos]))
+                cut = split_pos
+
+            result.append(events[i][1])
+            i += 1
+
+        result.append(chunk if cut == 0 else (ChunkType.TEXT, payload[cut:]))
+        pos = end
+
+    if first is None:
+        first = stop
+
+    # Highlights that end with the text.
+    if i < count:
+        result.extend(chunkbuffer[stop:])
+        result.extend(event for _, event in events[i:])
+        stop = len(chunkbuffer)
 
-    if target_pos == pos:
-        chunkbuffer.append(new_chunk)
+    chunkbuffer[first:stop] = result
@@ -18,63 +18,210 @@
 # a network stream into typed chunks: telnet code, ANSI code, etc...
 # It works by assembling a series of Filters.
 #
+# The Pipeline doesn't depend on Qt, so it can be used from scripts and
+# benchmarks. The timers it needs are created through an injectable factory;
+# SocketPipeline provides Qt ones.
+#
 
 
-from typing import Callable
+import time
 
-from PyQt6.QtCore import QObject
-from PyQt6.QtCore import pyqtSignal
+from collections import deque
+from typing import Callable, Optional
 
 from .ChunkData import ChunkType, ChunkT
 from .ChunkData import thePromptSweepChunk
 from .ChunkData import thePacketStartChunk, thePacketEndChunk
+from .ChunkData import theBlockEndChunk
+from .DispatchTable import DispatchTable
+from .PipelineStats import PipelineStats
+from .Timers import InertTimer, TimerFactoryT
 
-from SingleShotTimer import SingleShotTimer
 from CallbackRegistry import CallbackRegistry
 
 
-class Pipeline(QObject):
+class Pipeline:
     PROMPT_TIMEOUT = 700  # ms
 
-    flushBegin = pyqtSignal()
-    flushEnd = pyqtSignal()
-
-    def __init__(self):
-        super().__init__()
+    # Servers that mark their prompts may not mark all of them, like login or
+    # pager prompts. The timer still sweeps those, only later, so as not to
+    # cut lines that are merely slow to arrive.
+    PROMPT_FALLBACK_TIMEOUT = 3000  # ms
 
+    def __init__(self, timer_factory: TimerFactoryT = InertTimer):
         self.filters = []
+        self.head: Callable[[ChunkT], None] = lambda _: None
         self.outputBuffer: list[ChunkT] = []
-        self.sinks = dict((type_, CallbackRegistry()) for type_ in ChunkType)
+        self.sinks = DispatchTable()
+
+        # Set to a PipelineStats instance when profiling is enabled.
+        self.stats: Optional[PipelineStats] = None
 
         self.notification_registry = {}
 
-        self.prompt_timer = SingleShotTimer(self.sweepPrompt)
+        self.prompt_timer = timer_factory(self.sweepPrompt)
         self.prompt_timer.setInterval(self.PROMPT_TIMEOUT)
 
+        # Whether the server marks the end of its prompts, in which case the
+        # prompt timer is only a fallback.
+        self.prompts_marked = False
+        self.bindNotificationListener("prompts_marked", self.usePromptMarkers)
+
+        # Scheduler mode: when a time budget is set, incoming data is queued,
+        # and processed in slices that last no longer than the budget, so that
+        # the event loop gets to run in between.
+
+        self.time_budget: Optional[float] = None  # ms
+        self.pending: deque[tuple[float, ChunkT, int]] = deque()
+        self.pending_bytes = 0
+        self.lag = 0.0  # ms
+        self.max_lag = 0.0  # ms
+
+        self.process_timer = timer_factory(self.processPending)
+        self.process_timer.setInterval(0)
+
+    def setTimeBudget(self, budget: Optional[float]) -> None:
+        # A budget of None or 0 disables the scheduler, and data is then
+        # processed as soon as it's fed to the pipeline.
+
+        self.time_budget = budget or None
+
+        if self.time_budget is None:
+            self.drainPending()
+
+    def queueDepth(self) -> int:
+        # Returns the number of bytes waiting to be processed.
+
+        return self.pending_bytes
+
     def feedBytes(self, packet: bytes, blocksize: int = 2048) -> None:
         # 'packet' is a block of raw, unprocessed bytes. We make a chunk out of
         # it and feed that to the real chunk sink.
 
-        while packet:
+        if self.time_budget is not None:
+            if packet:
+                self.enqueue((ChunkType.BYTES, memoryview(packet)), blocksize)
+
+            # The prompt sweep must not happen before that packet has been
+            # processed.
+            self.prompt_timer.stop()
+            return
+
+        # Slicing a memoryview doesn't copy the underlying data, so the
+        # filters get to work on windows over the original packet. They only
+        # need to copy data when postponing an unfinished sequence.
+        view = memoryview(packet)
+
+        for offset in range(0, len(view), blocksize):
             # Splitting the packet into chunks of limited size makes for
             # slightly slower processing overall, but better responsiveness,
             # when processing large packets.
-            newbytes, packet = packet[:blocksize], packet[blocksize:]
+            newbytes = view[offset : offset + blocksize]
 
             self.feedChunk(thePacketStartChunk, autoflush=False)
             self.feedChunk((ChunkType.BYTES, newbytes), autoflush=False)
-            self.feedChunk(thePacketEndChunk)
+            self.feedChunk(
+                thePacketEndChunk
+                if offset + blocksize >= len(view)
+                else theBlockEndChunk
+            )
 
-        self.prompt_timer.start()
+        self.startPromptTimer()
 
     def sweepPrompt(self) -> None:
         self.feedChunk(thePromptSweepChunk)
 
+    def startPromptTimer(self) -> None:
+        self.prompt_timer.start()
+
+    def usePromptMarkers(self) -> None:
+        self.prompts_marked = True
+        self.prompt_timer.setInterval(self.PROMPT_FALLBACK_TIMEOUT)
+
+    def enqueue(self, chunk: ChunkT, blocksize: int = 0) -> None:
+        chunk_type, payload = chunk
+
+        if chunk_type == ChunkType.BYTES:
+            self.pending_bytes += len(payload)
+
+        self.pending.append((time.monotonic(), chunk, blocksize))
+        self.process_timer.start()
+
+    def processPending(self) -> None:
+        self.processQueue(self.time_budget)
+
+    def drainPending(self) -> None:
+        self.processQueue(None)
+
+    def processQueue(self, budget: Optional[float]) -> None:
+        # Process queued data until the queue is empty or the time budget (in
+        # ms) runs out, whichever comes first. A budget of None means no limit.
+
+        if not self.pending:
+            return
+
+        deadline = None if budget is None else time.monotonic() + budget / 1000
+
+        while self.pending:
+            timestamp, chunk, blocksize = self.pending[0]
+            chunk_type, payload = chunk
+
+            if chunk_type == ChunkType.BYTES:
+                # Large packets are processed one block at a time, so we can
+                # check the time budget in between.
+                block, remainder = payload[:blocksize], payload[blocksize:]
+
+                if remainder:
+                    self.pending[0] = (
+                        timestamp,
+                        (ChunkType.BYTES, remainder),
+                        blocksize,
+                    )
+
+                else:
+                    self.pending.popleft()
+
+                self.pending_bytes -= len(block)
+
+                self.feedChunk(thePacketStartChunk, autoflush=False)
+                self.feedChunk((ChunkType.BYTES, block), autoflush=False)
+                self.feedChunk(
+                    theBlockEndChunk if remainder else thePacketEndChunk,
+                    autoflush=False,
+                )
+
+            else:
+                self.pending.popleft()
+                self.feedChunk(chunk, autoflush=False)
+
+            now = time.monotonic()
+            self.lag = (now - timestamp) * 1000
+            self.max_lag = max(self.max_lag, self.lag)
+
+            if deadline is not None and now >= deadline:
+                break
+
+        self.flushOutputBuffer()
+
+        if self.pending:
+            # Yield to the event loop, and resume on its next iteration.
+            self.process_timer.start()
+
+        else:
+            self.process_timer.stop()
+            self.startPromptTimer()
+
     def feedChunk(self, chunk, autoflush=True):
         if not self.filters:
             return
 
-        self.filters[0].feedChunk(chunk)
+        if autoflush and self.pending:
+            # There is data waiting to be processed ahead of this chunk. Queue
+            # it to preserve the order of the stream.
+            self.enqueue(chunk)
+            return
+
+        self.head(chunk)
 
         # When the above call returns, the chunk as been fully processed through
         # the chain of filters, and the resulting chunks are waiting in the
@@ -84,16 +231,29 @@ class Pipeline(QObject):
             self.flushOutputBuffer()
 
     def appendToOutputBuffer(self, chunk) -> None:
+        chunk_type, payload = chunk
+
+        if chunk_type == ChunkType.BYTES:
+            # Don't let windows over our packets leak out to the sinks.
+            chunk = (chunk_type, bytes(payload))
+
         self.outputBuffer.append(chunk)
 
     def flushOutputBuffer(self) -> None:
-        self.flushBegin.emit()
+        self.notify("flush_begin")
+
+        if self.stats is None:
+            self.sinks.dispatch(self.outputBuffer)
 
-        for chunk in self.outputBuffer:
-            chunk_type, _ = chunk
-            self.sinks[chunk_type].triggerAll(chunk)
+        else:
+            start = time.perf_counter()
+            self.sinks.dispatchProfiled(self.outputBuffer, self.stats)
 
-        self.flushEnd.emit()
+            self.stats.flushes += 1
+            self.stats.flushed_chunks += len(self.outputBuffer)
+            self.stats.flush_time.record(time.perf_counter() - start)
+
+        self.notify("flush_end")
 
         self.outputBuffer = []
 
@@ -102,23 +262,49 @@ class Pipeline(QObject):
 
         filter = filterclass(**kwargs)
 
-        filter.setSink(self.appendToOutputBuffer)
+        self.filters.append(filter)
+        self.linkFilters()
+
+    def linkFilters(self) -> None:
+        # Connect each filter to the next, and the last one to the output
+        # buffer. When profiling, the connections go through measuring
+        # wrappers; otherwise the filters call each other directly, so that
+        # disabled profiling costs nothing.
 
-        if self.filters:
-            self.filters[-1].setSink(filter.feedChunk)
+        names = [filter.__class__.__name__ for filter in self.filters]
+        feeds = [filter.feedChunk for filter in self.filters]
+        feeds.append(self.appendToOutputBuffer)
+        names.append("")
 
-        self.filters.append(filter)
+        if self.stats is not None:
+            feeds = [
+                self.stats.profiledLink(source, target, feed)
+                for source, target, feed in zip([""] + names, names, feeds)
+            ]
+
+        self.head = feeds[0] if self.filters else lambda _: None
+
+        for filter, sink in zip(self.filters, feeds[1:]):
+            filter.setSink(sink)
+
+    def setProfiling(self, enabled: bool) -> None:
+        if enabled and self.stats is None:
+            self.stats = PipelineStats()
+
+        elif not enabled:
+            self.stats = None
+
+        self.linkFilters()
 
     def addSink(
         self,
         callback: Callable[[ChunkType], None],
-        types: int = ChunkType.all(),
+        types: int = ChunkType.allButGag(),
     ) -> None:
-        # 'callback' should be a callable that accepts and handles a chunk.
+        # 'callback' should be a callable that accepts and handles a chunk, or
+        # that takes no argument at all.
 
-        for type in ChunkType:
-            if type & types:
-                self.sinks[type].add(callback)
+        self.sinks.add(callback, types)
 
     def formatForSending(self, data: bytes) -> bytes:
         for filter in reversed(self.filters):
@@ -126,7 +312,41 @@ class Pipeline(QObject):
 
         return data
 
+    def send(self, data: bytes, sender=None) -> None:
+        # Formats data with the filters upstream of the sender, if any, and
+        # has it sent to the server.
+
+        filters = self.filters
+
+        if sender in filters:
+            filters = filters[: filters.index(sender)]
+
+        for filter in reversed(filters):
+            data = filter.formatForSending(data)
+
+        self.notify("send_bytes", data)
+
+    def findFilter(self, filterclass):
+        for filter in self.filters:
+            if isinstance(filter, filterclass):
+                return filter
+
+        return None
+
+    def close(self) -> None:
+        # Releases what the filters hold that wouldn't go away on its own,
+        # like processes, when the pipeline is no longer used.
+
+        for f in self.filters:
+            f.close()
+
     def resetInternalState(self) -> None:
+        # Don't lose the output of the previous connection, if some is left.
+        self.drainPending()
+
+        self.prompts_marked = False
+        self.prompt_timer.setInterval(self.PROMPT_TIMEOUT)
+
         for f in self.filters:
             f.resetInternalState()
 
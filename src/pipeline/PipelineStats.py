@@ -0,0 +1,180 @@
+# Copyright (c) 2007-2022 Pascal Varet <p.varet@gmail.com>
+#
+# This file is part of Spyrit.
+#
+# Spyrit is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 2 as published by the Free
+# Software Foundation.
+#
+# You should have received a copy of the GNU General Public License along with
+# Spyrit; if not, write to the Free Software Foundation, Inc., 51 Franklin St,
+# Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+#
+# PipelineStats.py
+#
+# This file holds the PipelineStats class, which records where the time goes
+# when chunks are processed by a pipeline's filters and sinks.
+#
+
+
+import time
+
+from typing import Any, Callable
+
+from .ChunkData import ChunkT
+
+
+def payload_size(payload: Any) -> int:
+    if isinstance(payload, (bytes, bytearray, memoryview, str)):
+        return len(payload)
+
+    return 0
+
+
+class StageStats:
+    # Measurements for one filter or sink of the pipeline.
+
+    def __init__(self, name: str):
+        self.name = name
+        self.chunks_in = 0
+        self.chunks_out = 0
+        self.bytes_in = 0
+        self.total_time = 0.0  # s
+        self.max_time = 0.0  # s
+
+    def record(self, elapsed: float) -> None:
+        self.total_time += elapsed
+
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+
+class PipelineStats:
+    def __init__(self):
+        self.filters: dict[str, StageStats] = {}
+        self.sinks: dict[str, StageStats] = {}
+
+        # Time spent in the stages called from the current one. Filters call
+        # the next filter in the chain themselves, so we need it to compute
+        # the time spent in each filter proper.
+        self.nested_time = 0.0
+
+        self.reset()
+
+    def reset(self) -> None:
+        self.filters.clear()
+        self.sinks.clear()
+        self.flushes = 0
+        self.flushed_chunks = 0
+        self.flush_time = StageStats("flush")
+        self.started = time.monotonic()
+
+    def filterStats(self, name: str) -> StageStats:
+        stats = self.filters.get(name)
+
+        if stats is None:
+            stats = self.filters[name] = StageStats(name)
+
+        return stats
+
+    def sinkStats(self, name: str) -> StageStats:
+        stats = self.sinks.get(name)
+
+        if stats is None:
+            stats = self.sinks[name] = StageStats(name)
+
+        return stats
+
+    def profiledLink(
+        self,
+        source: str,
+        target: str,
+        feed: Callable[[ChunkT], None],
+    ) -> Callable[[ChunkT], None]:
+        # Returns a callable that feeds chunks to 'feed', which belongs to the
+        # 'target' filter, and keeps track of what went in and out of the
+        # filters involved. 'source' is the name of the filter upstream, or an
+        # empty string if the chunks come straight from the pipeline. Likewise,
+        # 'target' is empty if the chunks go to the pipeline's output buffer.
+
+        perf_counter = time.perf_counter
+
+        if not target:
+
+            def count_output(chunk: ChunkT) -> None:
+                self.filterStats(source).chunks_out += 1
+                feed(chunk)
+
+            return count_output
+
+        def profiled_feed(chunk: ChunkT) -> None:
+            if source:
+                self.filterStats(source).chunks_out += 1
+
+            stats = self.filterStats(target)
+            stats.chunks_in += 1
+            stats.bytes_in += payload_size(chunk[1])
+
+            outer_nested_time = self.nested_time
+            self.nested_time = 0.0
+
+            start = perf_counter()
+            try:
+                feed(chunk)
+
+            finally:
+                elapsed = perf_counter() - start
+                stats.record(elapsed - self.nested_time)
+                self.nested_time = outer_nested_time + elapsed
+
+        return profiled_feed
+
+    def report(self) -> str:
+        msg = []
+
+        duration = time.monotonic() - self.started
+
+        msg.append("Pipeline statistics over the last %.1fs:" % duration)
+        msg.append(
+            "  %d flush(es), %d chunk(s) flushed, %.1f ms total, %.2f ms max."
+            % (
+                self.flushes,
+                self.flushed_chunks,
+                self.flush_time.total_time * 1000,
+                self.flush_time.max_time * 1000,
+            )
+        )
+
+        for title, stages in (
+            ("Filters", self.filters),
+            ("Sinks", self.sinks),
+        ):
+            msg.append("%s:" % title)
+
+            if not stages:
+                msg.append("  None.")
+
+            for stats in sorted(
+                stages.values(), key=lambda s: s.total_time, reverse=True
+            ):
+                counts = "%d chunk(s) in" % stats.chunks_in
+
+                if stages is self.filters:
+                    counts += ", %d out, %d byte(s) in" % (
+                        stats.chunks_out,
+                        stats.bytes_in,
+                    )
+
+                msg.append(
+                    "  %s: %s; %.1f ms total, %.2f ms max."
+                    % (
+                        stats.name,
+                        counts,
+                        stats.total_time * 1000,
+                        stats.max_time * 1000,
+                    )
+                )
+
+        return "\n".join(msg)
@@ -0,0 +1,228 @@
+# Copyright (c) 2007-2022 Pascal Varet <p.varet@gmail.com>
+#
+# This file is part of Spyrit.
+#
+# Spyrit is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 2 as published by the Free
+# Software Foundation.
+#
+# You should have received a copy of the GNU General Public License along with
+# Spyrit; if not, write to the Free Software Foundation, Inc., 51 Franklin St,
+# Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+#
+# SessionRecord.py
+#
+# This file holds the tools to record the raw packets received during a
+# session, with their timing, and to replay them through a pipeline later.
+#
+# A session file starts with a magic string, followed by one record per packet.
+# A record is the time elapsed since the previous packet, in microseconds, then
+# the size of the packet, both as LEB128 variable length integers, then the
+# packet itself. That way most records cost only 3 or 4 bytes on top of the
+# packet.
+#
+
+"""
+:doctest:
+
+>>> import io
+>>> from pipeline.SessionRecord import *
+
+Let's record a few packets with a fake clock:
+
+>>> now = 0.0
+>>> f = io.BytesIO()
+>>> recorder = SessionRecorder( f, clock=lambda: now )
+>>> recorder.record( b"Hello " )
+>>> now = 0.25
+>>> recorder.record( b"world!\\r\\n" )
+>>> now = 300.0
+>>> recorder.record( b"Bye." )
+
+And read them back, timestamped relative to the first packet:
+
+>>> list( read_session( io.BytesIO( f.getvalue() ) ) )
+[(0.0, b'Hello '), (0.25, b'world!\\r\\n'), (300.0, b'Bye.')]
+
+Files that aren't session records are rejected:
+
+>>> list( read_session( io.BytesIO( b"Not a session" ) ) )
+Traceback (most recent call last):
+...
+pipeline.SessionRecord.SessionFormatError: Not a session file.
+
+"""
+
+
+import math
+import time
+
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional
+
+from .Pipeline import Pipeline
+from .Timers import InertTimer, TimerFactoryT
+
+
+MAGIC = b"SPYSESS\x01"
+
+
+class SessionFormatError(Exception):
+    """
+    Raised when a session file can't be parsed.
+    """
+
+    pass
+
+
+def encode_varint(n: int) -> bytes:
+    out = bytearray()
+
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+
+    out.append(n)
+
+    return bytes(out)
+
+
+def decode_varint(data: bytes, pos: int) -> tuple[int, int]:
+    # Returns the integer that starts at 'pos' in data, and the position right
+    # after it.
+
+    n = 0
+    shift = 0
+
+    while True:
+        if pos >= len(data):
+            raise SessionFormatError("Truncated session file.")
+
+        byte = data[pos]
+        pos += 1
+
+        n |= (byte & 0x7F) << shift
+        shift += 7
+
+        if not byte & 0x80:
+            return n, pos
+
+
+class SessionRecorder:
+    def __init__(
+        self, file: BinaryIO, clock: Callable[[], float] = time.monotonic
+    ):
+        self.file = file
+        self.clock = clock
+        self.last: Optional[int] = None  # µs
+
+        self.file.write(MAGIC)
+
+    def record(self, data: bytes) -> None:
+        now = int(self.clock() * 1_000_000)
+
+        if self.last is None:
+            self.last = now
+
+        delta, self.last = now - self.last, now
+
+        self.file.write(encode_varint(delta) + encode_varint(len(data)))
+        self.file.write(data)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_session(file: BinaryIO) -> Iterator[tuple[float, bytes]]:
+    # Yields the packets of a session file, along with their timestamp in
+    # seconds since the first packet.
+
+    data = file.read()
+
+    if not data.startswith(MAGIC):
+        raise SessionFormatError("Not a session file.")
+
+    pos = len(MAGIC)
+    timestamp = 0  # µs
+
+    while pos < len(data):
+        delta, pos = decode_varint(data, pos)
+        size, pos = decode_varint(data, pos)
+
+        if pos + size > len(data):
+            raise SessionFormatError("Truncated session file.")
+
+        timestamp += delta
+        yield timestamp / 1_000_000, data[pos : pos + size]
+
+        pos += size
+
+
+class SessionReplayer:
+    # Feeds recorded packets to a pipeline, either as fast as possible (speed
+    # 0), or following the recorded timing, sped up by the given factor. The
+    # latter requires a timer factory whose timers actually fire.
+
+    def __init__(
+        self,
+        pipeline: Pipeline,
+        packets: Iterable[tuple[float, bytes]],
+        speed: float = 1.0,
+        timer_factory: TimerFactoryT = InertTimer,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.pipeline = pipeline
+        self.packets = iter(packets)
+        self.speed = speed
+        self.clock = clock
+
+        self.timer = timer_factory(self.replayDue)
+        self.started = 0.0
+        self.packets_replayed = 0
+        self.bytes_replayed = 0
+
+        self.next_packet = next(self.packets, None)
+
+    def isFinished(self) -> bool:
+        return self.next_packet is None
+
+    def start(self) -> None:
+        if not self.speed:
+            self.replayAll()
+            return
+
+        self.started = self.clock()
+        self.replayDue()
+
+    def stop(self) -> None:
+        self.timer.stop()
+        self.next_packet = None
+
+    def feedNextPacket(self) -> None:
+        assert self.next_packet is not None
+        _, data = self.next_packet
+
+        self.pipeline.feedBytes(data)
+        self.packets_replayed += 1
+        self.bytes_replayed += len(data)
+
+        self.next_packet = next(self.packets, None)
+
+    def replayAll(self) -> None:
+        while self.next_packet is not None:
+            self.feedNextPacket()
+
+    def replayDue(self) -> None:
+        # Feed the packets whose time has come, then wait for the next one.
+
+        # Timers have a millisecond resolution, so allow for rounding.
+        elapsed = (self.clock() - self.started) * self.speed + 0.0005
+
+        while self.next_packet is not None and self.next_packet[0] <= elapsed:
+            self.feedNextPacket()
+
+        if self.next_packet is not None:
+            delay = (self.next_packet[0] - elapsed) / self.speed
+            self.timer.setInterval(max(1, math.ceil(delay * 1000)))
+            self.timer.start()
@@ -18,23 +18,29 @@
 # socket and manages connection/disconnection and everything.
 #
 
+from typing import BinaryIO, Iterable, Optional
+
 from PyQt6.QtCore import QObject
 from PyQt6.QtCore import QTimer
+from PyQt6.QtCore import pyqtSignal
 from PyQt6.QtCore import pyqtSlot
-from PyQt6.QtWidgets import QApplication
 from PyQt6.QtNetwork import QSslSocket
 from PyQt6.QtNetwork import QTcpSocket
 from PyQt6.QtNetwork import QAbstractSocket
 
 from .Pipeline import Pipeline
 from .AnsiFilter import AnsiFilter
+from .CompressionFilter import CompressionFilter
 from .TelnetFilter import TelnetFilter
+from .FusedTokenizerFilter import FusedTokenizerFilter
 from .TriggersFilter import TriggersFilter
 from .FlowControlFilter import FlowControlFilter
 from .UnicodeTextFilter import UnicodeTextFilter
 
 from .ChunkData import ChunkType
 from .ChunkData import NetworkState
+from .SessionRecord import SessionRecorder
+from .SessionRecord import SessionReplayer
 
 from Messages import messages
 from Utilities import check_ssl_is_available
@@ -42,36 +48,79 @@ from SingleShotTimer import SingleShotTimer
 
 
 class SocketPipeline(QObject):
-    def __init__(self, settings):
+    # Qt flavored notifications of the beginning and end of the pipeline's
+    # output flushes.
+
+    flushBegin = pyqtSignal()
+    flushEnd = pyqtSignal()
+
+    def __init__(self, settings, triggersmanager):
         super().__init__()
 
         self.net_settings = settings._net
+        self.triggersmanager = triggersmanager
+
+        self.pipeline = Pipeline(timer_factory=SingleShotTimer)
+        self.pipeline.bindNotificationListener("flush_begin", self.flushBegins)
+        self.pipeline.bindNotificationListener("flush_end", self.flushEnds)
+        self.pipeline.bindNotificationListener("send_bytes", self.sendRaw)
+
+        # Compression works on the raw stream, so it goes first.
+        self.pipeline.addFilter(CompressionFilter)
 
-        app = QApplication.instance()
-        assert app is not None
-        # TODO: Find a way to pass the core instance.
-        self.triggersmanager = app.core.triggers  # type: ignore
+        if self.net_settings._fused_tokenizer:
+            # Does the work of the four filters below in a single pass.
+            self.pipeline.addFilter(
+                FusedTokenizerFilter, encoding=self.net_settings._encoding
+            )
 
-        self.pipeline = Pipeline()
+        else:
+            self.pipeline.addFilter(TelnetFilter)
+            self.pipeline.addFilter(AnsiFilter)
+            self.pipeline.addFilter(
+                UnicodeTextFilter, encoding=self.net_settings._encoding
+            )
+            self.pipeline.addFilter(FlowControlFilter)
 
-        self.pipeline.addFilter(TelnetFilter)
-        self.pipeline.addFilter(AnsiFilter)
         self.pipeline.addFilter(
-            UnicodeTextFilter, encoding=self.net_settings._encoding
+            TriggersFilter,
+            manager=self.triggersmanager,
+            workers=self.net_settings._trigger_workers,
         )
-        self.pipeline.addFilter(FlowControlFilter)
-        self.pipeline.addFilter(TriggersFilter, manager=self.triggersmanager)
 
         self.using_ssl = False
         self.socket = None
         self.buffer: list[bytes] = []
 
+        self.recorder: Optional[SessionRecorder] = None
+        self.replayer: Optional[SessionReplayer] = None
+
         self.flush_timer = SingleShotTimer(self.flushBuffer)
         self.keepalive_timer = QTimer(self)
         self.keepalive_timer.timeout.connect(self.keepaliveTimeout)
 
         self.net_settings.onChange("encoding", self.setStreamEncoding)
 
+        self.setTimeBudget(self.net_settings._time_budget)
+        self.net_settings.onChange("time_budget", self.setTimeBudget)
+
+        self.net_settings.onChange("trigger_workers", self.setTriggerWorkers)
+
+    def setTimeBudget(self, budget: int):
+        self.pipeline.setTimeBudget(budget)
+
+    def setTriggerWorkers(self, workers: int):
+        triggersfilter = self.pipeline.findFilter(TriggersFilter)
+
+        if triggersfilter is not None:
+            triggersfilter.setWorkers(workers)
+
+    def flushBegins(self):
+        self.flushBegin.emit()
+
+    def flushEnds(self):
+        self.flushEnd.emit()
+
     def setStreamEncoding(self):
         if self.pipeline:
             self.pipeline.notify(
@@ -199,6 +248,9 @@ class SocketPipeline(QObject):
         data: bytes = self.socket.readAll().data()
         self.buffer.append(data)
 
+        if self.recorder is not None:
+            self.recorder.record(data)
+
         self.flush_timer.start()
         self.startKeepaliveTimer()
 
@@ -217,6 +269,17 @@ class SocketPipeline(QObject):
         self.pipeline.feedBytes(data)
 
     def send(self, data: str):
+        encoding = self.net_settings._encoding
+        databytes = self.pipeline.formatForSending(
+            data.encode(encoding, errors="ignore")
+        )
+
+        self.sendRaw(databytes)
+
+    def sendRaw(self, databytes: bytes):
+        # Send the given bytes as they are. Used by the filters to reply to
+        # the server, for instance for Telnet negotiations.
+
         if self.socket is None:
             return
 
@@ -227,14 +290,43 @@ class SocketPipeline(QObject):
             # Don't write anything if the socket is not connected.
             return
 
-        encoding = self.net_settings._encoding
-        databytes = self.pipeline.formatForSending(
-            data.encode(encoding, errors="ignore")
-        )
-
         self.socket.write(databytes)
         self.socket.flush()
         self.startKeepaliveTimer()
 
-    def addSink(self, sink, types: int = ChunkType.all()) -> None:
+    def close(self) -> None:
+        # Called when the world is closed.
+
+        self.stopRecording()
+        self.pipeline.close()
+
+    def startRecording(self, file: BinaryIO) -> None:
+        # Record the raw packets received from now on, with their timing, into
+        # the given file.
+
+        self.stopRecording()
+        self.recorder = SessionRecorder(file)
+
+    def stopRecording(self) -> None:
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def replay(
+        self, packets: Iterable[tuple[float, bytes]], speed: float = 1.0
+    ) -> SessionReplayer:
+        # Feed recorded packets to the pipeline, in real time if speed is 1,
+        # accelerated if it's more, and as fast as possible if it's 0.
+
+        if self.replayer is not None:
+            self.replayer.stop()
+
+        self.replayer = SessionReplayer(
+            self.pipeline, packets, speed, timer_factory=SingleShotTimer
+        )
+        self.replayer.start()
+
+        return self.replayer
+
+    def addSink(self, sink, types: int = ChunkType.allButGag()) -> None:
         self.pipeline.addSink(sink, types)
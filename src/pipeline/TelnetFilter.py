@@ -19,21 +19,62 @@
 # and take the necessary action when a negotiated option requires a
 # specific behavior from the client.
 #
+# The parser is an incremental state machine: it jumps from one IAC byte to
+# the next, and keeps its state between chunks, so sequences split across
+# packets, including subnegotiations of any size, are never scanned twice.
+#
+# IAC GA and IAC EOR mark the end of a prompt. The filter turns them into
+# prompt sweep chunks right away, so that prompts don't have to wait for the
+# pipeline's prompt timer.
+#
 
 
 import re
 
+from typing import Optional
+
 from .BaseFilter import BaseFilter
 from .ChunkData import ChunkType
+from .ChunkData import thePromptSweepChunk
+from .CompressionFilter import CompressionFilter
+from .CompressionFilter import COMPRESS2, COMPRESS3
 
 
 def bytechr(i):
     return bytes([i])
 
 
+# The states of the Telnet parser.
+
+DATA = 0  # Plain data.
+COMMAND = 1  # Right after an IAC.
+OPTION = 2  # Right after IAC WILL, WONT, DO or DONT.
+SUBOPTION = 3  # Right after IAC SB.
+SUBDATA = 4  # Inside a subnegotiation.
+SUBIAC = 5  # Right after an IAC inside a subnegotiation.
+
+# The byte values the parser looks for.
+
+EOR_BYTE = 239
+SE_BYTE = 240
+GA_BYTE = 249
+SB_BYTE = 250
+WILL_BYTE = 251
+WONT_BYTE = 252
+DO_BYTE = 253
+DONT_BYTE = 254
+IAC_BYTE = 255
+
+# The options we negotiate.
+
+SGA_OPTION = 3  # Suppress Go Ahead, RFC 858.
+EOR_OPTION = 25  # End Of Record, RFC 885.
+
+
 class TelnetFilter(BaseFilter):
     relevant_types = ChunkType.BYTES
 
+    EOR = bytechr(239)  # End of record
     SE = bytechr(240)  # End option subnegotiation
     NOP = bytechr(241)  # No operation
     DM = bytechr(242)  # Data mark for Synch operation
@@ -53,93 +94,258 @@ class TelnetFilter(BaseFilter):
 
     IAC = bytechr(255)
 
-    match = re.compile(
-        IAC
-        + b"(?:"
-        + b"(?P<cmd>"
-        + b"|".join([NOP, DM, BRK, IP, AO, AYT, EC, EL, GA, IAC])
-        + b")"
-        + b"|"
-        + b"(?:"
-        + b"(?P<cmdopt>"
-        + WILL
-        + b"|"
-        + WONT
-        + b"|"
-        + DO
-        + b"|"
-        + DONT
-        + b")"
-        + b"(?P<opt>.)"
-        + b")"
-        + b"|"
-        + b"(?:"
-        + SB
-        + b"(?P<subopt>.)"
-        + b"(?P<subparam>.*)"
-        + IAC
-        + SE
-        + b")"
-        + b")"
-    )
-
-    unfinished = re.compile(
-        IAC
-        + b"("
-        + WILL
-        + b"|"
-        + WONT
-        + b"|"
-        + DO
-        + b"|"
-        + DONT
-        + b"("
-        + SB
-        + b".{0,256}"
-        + b")"
-        + b")?"
-        + b"$"
-    )
+    NEGOTIATION_COMMANDS = set(WILL + WONT + DO + DONT)
+
+    # Used to find IAC bytes in memoryviews, which don't have a find()
+    # method.
+    find_iac = re.compile(IAC).search
+
+    def resetInternalState(self):
+        self.state = DATA
+        self.command = 0
+        self.suboption = 0
+        self.subdata = bytearray()
+
+        # Whether the server agreed to mark the end of its records, which
+        # are prompts in practice, with IAC EOR.
+        self.eor_enabled = False
+
+        # Whether we already told the server to keep sending IAC GA.
+        self.sga_refused = False
+
+        # Whether we already saw a prompt marker on this connection.
+        self.prompts_marked = False
+
+        # The compression protocols (MCCP2 and 3) we agreed to use.
+        self.compression: set[int] = set()
+
+        # The last packet our chunks were views over, and whether it holds
+        # any IAC byte at all.
+        self.packet: Optional[bytes] = None
+        self.packet_has_iac = True
+
+        super().resetInternalState()
+
+    def isMidSequence(self) -> bool:
+        return self.state != DATA
 
     def processChunk(self, chunk):
-        _, text = chunk
+        _, data = chunk
 
-        while len(text) > 0:
-            telnet = self.match.search(text)
+        if self.state == DATA:
+            pos = self.findIAC(data, 0)
 
-            if telnet:
-                head = text[: telnet.start()]
-                text = text[telnet.end() :]
+            if pos == -1:
+                # No Telnet code here. This is the common case.
+                return (chunk,)
 
-                if head:
-                    yield (ChunkType.BYTES, head)
+        else:
+            # We're in the middle of a sequence started in an earlier chunk.
+            pos = 0
 
-                parameters = telnet.groupdict()
+        return self.parse(data, pos)
 
-                command = parameters["cmd"] or parameters["cmdopt"]
+    def findIAC(self, data, start: int) -> int:
+        # Returns the position of the first IAC byte in 'data' from 'start',
+        # or -1. The data is never copied: memoryviews are scanned in place.
 
-                if command == self.IAC:
-                    # This is an escaped IAC. Yield it as such.
-                    yield (ChunkType.BYTES, self.IAC)
-                    continue
+        if not isinstance(data, memoryview):
+            return data.find(self.IAC, start)
 
-                # TODO: Implement other commands?
+        packet = data.obj
 
-                elif command in (self.WILL, self.WONT, self.DO, self.DONT):
-                    pass  # TODO: Implement option negociation.
+        if type(packet) is bytes:
+            if len(data) == len(packet):
+                # The view spans its whole packet, which is the case of most
+                # packets. Search the packet itself, which is much faster
+                # than searching the view with a regex.
+                return packet.find(self.IAC, start)
 
-            else:
-                # The remaining text doesn't contain any complete Telnet
-                # sequence. So we quit the loop.
+            # Views over part of a packet don't tell where they start in it.
+            # But most packets hold no IAC at all, which can be found out once
+            # and for all of their views.
+            if packet is not self.packet:
+                self.packet = packet
+                self.packet_has_iac = self.IAC in packet
+
+            if not self.packet_has_iac:
+                return -1
+
+        iac = self.find_iac(data, start)
+
+        return -1 if iac is None else iac.start()
+
+    def parse(self, data, pos: int):
+        # Yields the data and the chunks resulting from the Telnet sequences
+        # in 'data', where the first sequence starts at 'pos'. The data
+        # between the sequences is sent along as slices of the original, so
+        # memoryviews aren't copied.
+
+        start = 0
+
+        while True:
+            if start < pos:
+                yield (ChunkType.BYTES, data[start:pos])
+
+            start, chunks = self.scanSequence(data, pos)
+            yield from chunks
+
+            pos = self.findIAC(data, start)
+
+            if pos == -1:
+                break
+
+        if start < len(data):
+            yield (ChunkType.BYTES, data[start:])
+
+    def scanSequence(self, data, pos: int):
+        # Runs the parser on 'data' from 'pos', which is either the position
+        # of an IAC byte, or the start of the data when resuming a sequence
+        # started in earlier data. Returns the position where the sequence
+        # ends, which is the end of the data if it's unfinished, along with
+        # the chunks it produces. The parser's state is kept from one call to
+        # the next, so unfinished sequences never need to be scanned again.
+
+        chunks = []
+        end = len(data)
+        state = self.state
+
+        if state == DATA:
+            state = COMMAND
+            pos += 1
+
+        while pos < end:
+            if state == SUBDATA:
+                iac = self.find_iac(data, pos)
+
+                if iac is None:
+                    self.subdata += data[pos:]
+                    pos = end
+                    break
+
+                self.subdata += data[pos : iac.start()]
+                pos = iac.end()
+                state = SUBIAC
+                continue
+
+            byte = data[pos]
+            pos += 1
+
+            if state == COMMAND:
+                if byte == IAC_BYTE:
+                    # This is an escaped IAC. Pass it along as data.
+                    chunks.append((ChunkType.BYTES, self.IAC))
+                    state = DATA
+
+                elif byte in self.NEGOTIATION_COMMANDS:
+                    self.command = byte
+                    state = OPTION
+
+                elif byte == SB_BYTE:
+                    state = SUBOPTION
+
+                elif byte == GA_BYTE or byte == EOR_BYTE:
+                    chunks.append(thePromptSweepChunk)
+                    state = DATA
+
+                    if not self.prompts_marked:
+                        # Let the pipeline know it only needs to guess where
+                        # the unmarked prompts are.
+                        self.prompts_marked = True
+                        self.notify("prompts_marked")
+
+                else:
+                    self.handleCommand(byte)
+                    state = DATA
+
+            elif state == OPTION:
+                self.handleNegotiation(self.command, byte)
+                state = DATA
+
+            elif state == SUBOPTION:
+                self.suboption = byte
+                self.subdata.clear()
+                state = SUBDATA
+
+            elif state == SUBIAC:
+                if byte == SE_BYTE:
+                    self.handleSubnegotiation(
+                        self.suboption, bytes(self.subdata)
+                    )
+                    self.subdata.clear()
+                    state = DATA
+
+                else:
+                    # IAC IAC is an escaped 0xff byte. Anything else is a
+                    # protocol error, which we tolerate by keeping the byte.
+                    self.subdata.append(byte)
+                    state = SUBDATA
+
+            if state == DATA:
                 break
 
-        if text:
-            if self.unfinished.search(text):
-                # Remaining text contains an unfinished Telnet sequence!
-                self.postpone((ChunkType.BYTES, text))
+        self.state = state
+
+        return pos, chunks
+
+    def handleCommand(self, command: int) -> None:
+        pass  # TODO: Implement other commands?
+
+    def handleNegotiation(self, command: int, option: int) -> None:
+        # TODO: Implement negotiation for more options.
+
+        if option == EOR_OPTION:
+            if command == WILL_BYTE and not self.eor_enabled:
+                self.eor_enabled = True
+                self.sendNegotiation(self.DO, option)
+
+            elif command == WONT_BYTE and self.eor_enabled:
+                self.eor_enabled = False
+                self.sendNegotiation(self.DONT, option)
+
+            elif command == DO_BYTE:
+                # We have no records to mark.
+                self.sendNegotiation(self.WONT, option)
+
+        elif option == SGA_OPTION:
+            if command == WILL_BYTE and not self.sga_refused:
+                # We want the server to keep sending GA, as that's how it
+                # tells us where its prompts end.
+                self.sga_refused = True
+                self.sendNegotiation(self.DONT, option)
+
+        elif option in (COMPRESS2, COMPRESS3):
+            if command != WILL_BYTE or option in self.compression:
+                return
+
+            if self.context is None or not self.context.findFilter(
+                CompressionFilter
+            ):
+                # Nobody to handle compression in this pipeline.
+                self.sendNegotiation(self.DONT, option)
+                return
+
+            self.compression.add(option)
+            self.sendNegotiation(self.DO, option)
+
+            if option == COMPRESS2:
+                # The server's data will be compressed from the next IAC SB
+                # COMPRESS2 IAC SE on.
+                self.notify("mccp2_accepted")
 
             else:
-                yield (ChunkType.BYTES, text)
+                # We start compressing our data right after telling the
+                # server so.
+                self.send(
+                    self.IAC + self.SB + bytechr(option) + self.IAC + self.SE
+                )
+                self.notify("mccp3_started")
+
+    def sendNegotiation(self, command: bytes, option: int) -> None:
+        self.send(self.IAC + command + bytechr(option))
+
+    def handleSubnegotiation(self, option: int, payload: bytes) -> None:
+        pass
 
     def formatForSending(self, data: bytes) -> bytes:
         # Escape the character 0xff in accordance with the telnet specification.
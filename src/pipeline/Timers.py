@@ -0,0 +1,144 @@
+# Copyright (c) 2007-2022 Pascal Varet <p.varet@gmail.com>
+#
+# This file is part of Spyrit.
+#
+# Spyrit is free software; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License version 2 as published by the Free
+# Software Foundation.
+#
+# You should have received a copy of the GNU General Public License along with
+# Spyrit; if not, write to the Free Software Foundation, Inc., 51 Franklin St,
+# Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+#
+# Timers.py
+#
+# This file holds the timers a Pipeline can use when it runs without Qt. They
+# implement the subset of the QTimer API that the Pipeline needs: setInterval(),
+# start(), stop() and isActive().
+#
+
+"""
+
+:doctest:
+
+>>> from pipeline.Timers import *
+
+"""
+
+
+from typing import Callable, Protocol
+
+
+class TimerT(Protocol):
+    def setInterval(self, msec: int) -> None:
+        ...
+
+    def start(self) -> None:
+        ...
+
+    def stop(self) -> None:
+        ...
+
+    def isActive(self) -> bool:
+        ...
+
+
+TimerFactoryT = Callable[[Callable[[], None]], TimerT]
+
+
+class InertTimer:
+    # A timer that never fires. This is the default for pipelines that are
+    # driven by hand, e.g. from scripts that call sweepPrompt() and
+    # processPending() themselves.
+
+    def __init__(self, slot: Callable[[], None]):
+        self.slot = slot
+        self.interval = 0
+        self.active = False
+
+    def setInterval(self, msec: int) -> None:
+        self.interval = msec
+
+    def start(self) -> None:
+        self.active = True
+
+    def stop(self) -> None:
+        self.active = False
+
+    def isActive(self) -> bool:
+        return self.active
+
+
+class ManualClock:
+
+    """
+    A clock whose time only passes when told to, and whose timers fire
+    accordingly. Useful for running a pipeline deterministically, for instance
+    when replaying a recorded session.
+
+    >>> clock = ManualClock()
+    >>> def ping():
+    ...   print( "Ping at %d ms!" % clock.now )
+
+    >>> timer = clock.createTimer( ping )
+    >>> timer.setInterval( 700 )
+    >>> timer.start()
+    >>> clock.advance( 500 )
+
+    Restarting the timer pushes its deadline back, like with a QTimer:
+
+    >>> timer.start()
+    >>> clock.advance( 500 )
+    >>> clock.advance( 500 )
+    Ping at 1200 ms!
+    >>> clock.advance( 1000 )
+
+    """
+
+    def __init__(self):
+        self.now = 0.0  # ms
+        self.timers: list[ClockTimer] = []
+
+    def createTimer(self, slot: Callable[[], None]) -> "ClockTimer":
+        timer = ClockTimer(self, slot)
+        self.timers.append(timer)
+
+        return timer
+
+    def advance(self, msec: float) -> None:
+        target = self.now + msec
+
+        while True:
+            due = [
+                timer
+                for timer in self.timers
+                if timer.active and timer.deadline <= target
+            ]
+
+            if not due:
+                break
+
+            timer = min(due, key=lambda t: t.deadline)
+
+            self.now = max(self.now, timer.deadline)
+            timer.active = False
+            timer.slot()
+
+        self.now = target
+
+
+class ClockTimer(InertTimer):
+    # A single shot timer that fires when its ManualClock is advanced past its
+    # deadline.
+
+    def __init__(self, clock: ManualClock, slot: Callable[[], None]):
+        super().__init__(slot)
+
+        self.clock = clock
+        self.deadline = 0.0
+
+    def start(self) -> None:
+        self.deadline = self.clock.now + self.interval
+        self.active = True
@@ -19,31 +19,77 @@
 # world's registered match patterns and triggers the corresponding action
 # as needed.
 #
+# Optionally, the lines can be matched by a pool of worker processes. The
+# completed lines are then held until the end of the packet they came in, or
+# until enough of them are pending, matched all at once, and sent downstream
+# in order with their actions applied.
+#
 
 
-from typing import Iterable
+from typing import Iterable, Optional
 
 from .BaseFilter import BaseFilter
 
 from .ChunkData import ChunkT
 from .ChunkData import ChunkType
 from .ChunkData import FlowControl
+from .ChunkData import NetworkState
+from .ChunkData import PacketBoundary
 
 from .Pipeline import Pipeline
 
+from Globals import CMDCHAR
+from MatchWorkers import MatchWorkerPool
+
+
+# Within a large packet, the lines pending for the worker pool are matched
+# once there are this many of them, rather than at the end of the packet.
+MAX_PENDING_LINES = 512
+
 
 class TriggersFilter(BaseFilter):
-    def __init__(self, context: Pipeline, manager=None):
+    def __init__(self, context: Pipeline, manager=None, workers: int = 0):
         self.buffer: list[ChunkT] = []
+
+        # The completed lines waiting to be matched by the worker pool, with
+        # their chunks.
+        self.lines: list[tuple[str, list[ChunkT]]] = []
+        self.pool: Optional[MatchWorkerPool] = None
+        self.workers = 0
+
         self.setManager(manager)
+        self.setWorkers(workers)
 
         super().__init__(context)
 
     def setManager(self, manager):
         self.manager = manager
 
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+            self.setWorkers(self.workers)
+
+    def setWorkers(self, workers: int):
+        # Sets the number of worker processes that match the lines. With 0,
+        # lines are matched in this process as they complete.
+
+        self.workers = workers
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+        if workers > 0 and self.manager:
+            self.pool = MatchWorkerPool(self.manager, workers)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
     def resetInternalState(self):
         self.buffer.clear()
+        self.lines.clear()
         super().resetInternalState()
 
     def processChunk(self, chunk: ChunkT) -> Iterable[ChunkT]:
@@ -71,10 +117,63 @@ class TriggersFilter(BaseFilter):
                 chunk[1] for chunk in self.buffer if chunk[0] == ChunkType.TEXT
             )
 
-            if line:
-                self.manager.performMatchingActions(line, self.buffer)
+            if self.pool is not None:
+                self.lines.append((line, self.buffer))
+                self.buffer = []
+
+            else:
+                if self.lines:
+                    # The pool was just shut down. Its pending lines go first.
+                    yield from self.matchLines()
 
-            for chunk in self.buffer:
-                yield chunk
+                if line:
+                    self.manager.performMatchingActions(line, self.buffer)
+                    self.reportDisabledMatches()
+
+                for chunk in self.buffer:
+                    yield chunk
+
+                self.buffer = []
+
+        if self.lines and (
+            chunk_type in (ChunkType.NETWORK, ChunkType.PROMPTSWEEP)
+            or chunk == (ChunkType.PACKETBOUND, PacketBoundary.END)
+            or len(self.lines) >= MAX_PENDING_LINES
+        ):
+            yield from self.matchLines()
+
+        if chunk == (ChunkType.NETWORK, NetworkState.DISCONNECTED):
+            # Don't keep the workers around while there is nothing to match.
+            # They start again with the next batch.
+            self.close()
+
+    def reportDisabledMatches(self):
+        for matchgroup, match, elapsed in self.manager.takeDisabledMatches():
+            self.notify(
+                "match_disabled",
+                "Match pattern %s of group '%s' took too long to run (%d ms "
+                "on the last line), and was disabled. Use %smatch enable to "
+                "enable it again."
+                % (match.toString(), matchgroup.name, elapsed * 1000, CMDCHAR),
+            )
+
+    def matchLines(self):
+        lines = self.lines
+        self.lines = []
+
+        texts = [line for line, _ in lines if line]
+
+        if self.pool is not None:
+            all_matches = self.pool.findMatches(texts)
+
+        else:
+            all_matches = [self.manager.findMatches(line) for line in texts]
+
+        all_matches.reverse()
+        self.reportDisabledMatches()
+
+        for line, chunkbuffer in lines:
+            if line:
+                self.manager.performActions(all_matches.pop(), chunkbuffer)
 
-            self.buffer = []
+            yield from chunkbuffer
@@ -0,0 +1,513 @@
+#!/usr/bin/env python
+
+"""
+Measures the throughput of the pipeline on the corpora in tests/data.
+
+Each corpus is fed, in blocks of the given sizes, through the full filter chain
+(the way SocketPipeline sets it up), through the fused tokenizer chain, and
+through each filter in isolation. For the latter, the filter is fed the exact
+stream of chunks it sees in the full chain, recorded beforehand.
+
+Session files, as recorded with '/debug record', can also be used as corpora.
+They are additionally fed with their real packet boundaries, as block size
+"recorded".
+
+For each run, this reports:
+
+- MB/s: megabytes of raw corpus data processed per second;
+- lines/s: lines of corpus data processed per second;
+- chunks: the number of chunks output by the chain or filter;
+- allocs/chunk: the number of memory blocks still allocated per output chunk
+  when all the output chunks are kept alive. This counts the chunks
+  themselves and their payload, and any copy made along the way that ends up
+  referenced by the output.
+
+With --scaling, each corpus is also fed as a single packet, the way a large
+'/load' is, at 1, 4 and 16 times its size. The time it takes should grow
+linearly with the size, so the time per megabyte is reported along with its
+ratio to that of the smallest size, which should stay close to 1.
+
+The results can be saved to a JSON file, and compared to such a file from an
+earlier run, in which case the runs whose throughput dropped by more than the
+given tolerance are reported, and the exit status is 1.
+
+Usage examples:
+
+    ./pipeline_throughput.py --save baseline.json
+    ./pipeline_throughput.py --compare baseline.json
+    ./pipeline_throughput.py --blocks 1-16 --configs chain,fused ansi-long.txt
+    ./pipeline_throughput.py --scaling --configs chain,fused ansi-long.txt
+"""
+
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__) or os.curdir)
+DATA_DIR = os.path.normpath(os.path.join(THIS_DIR, os.path.pardir, "data"))
+SPYRIT_DIR = os.path.normpath(
+    os.path.join(THIS_DIR, os.path.pardir, os.path.pardir, "src")
+)
+
+sys.path.insert(0, SPYRIT_DIR)
+
+from pipeline.AnsiFilter import AnsiFilter  # noqa: E402
+from pipeline.BaseFilter import BaseFilter  # noqa: E402
+from pipeline.FlowControlFilter import FlowControlFilter  # noqa: E402
+from pipeline.FusedTokenizerFilter import FusedTokenizerFilter  # noqa: E402
+from pipeline.Pipeline import Pipeline  # noqa: E402
+from pipeline.SessionRecord import MAGIC, read_session  # noqa: E402
+from pipeline.TelnetFilter import TelnetFilter  # noqa: E402
+from pipeline.TriggersFilter import TriggersFilter  # noqa: E402
+from pipeline.UnicodeTextFilter import UnicodeTextFilter  # noqa: E402
+from TriggersManager import TriggersManager  # noqa: E402
+
+
+DEFAULT_CORPORA = ["ansi-long.txt", "plain-long.txt", "ansi-telnet-sample.txt"]
+
+# "1-16" is the random fragmentation that dummyserver.py uses.
+DEFAULT_BLOCKS = ["1-16", "64", "512", "2048"]
+
+DEFAULT_MIN_SIZE = 256 * 1024  # bytes
+DEFAULT_TOLERANCE = 0.10
+SCALING_FACTORS = [1, 4, 16]
+SEED = 1337
+
+
+def chain_specs(name, encoding):
+    # Returns the list of (filter class, arguments) pairs of the named chain.
+    # The triggers manager is empty, but still runs the default matches, like
+    # the one of a fresh install.
+
+    triggers = (TriggersFilter, {"manager": TriggersManager()})
+
+    if name == "fused":
+        return [(FusedTokenizerFilter, {"encoding": encoding}), triggers]
+
+    return [
+        (TelnetFilter, {}),
+        (AnsiFilter, {}),
+        (UnicodeTextFilter, {"encoding": encoding}),
+        (FlowControlFilter, {}),
+        triggers,
+    ]
+
+
+def all_configs():
+    configs = ["chain", "fused"]
+
+    for chain in ("chain", "fused"):
+        for filterclass, _ in chain_specs(chain, "ascii"):
+            if filterclass.__name__ not in configs:
+                configs.append(filterclass.__name__)
+
+    return configs
+
+
+def split_blocks(data, spec):
+    # Splits data into blocks according to the spec, which is either a size,
+    # or a "min-max" range of random sizes.
+
+    if "-" in spec:
+        low, high = (int(n) for n in spec.split("-", 1))
+        rng = random.Random(SEED)
+        sizes = iter(lambda: rng.randint(low, high), None)
+
+    else:
+        size = int(spec)
+        sizes = iter(lambda: size, None)
+
+    blocks = []
+    pos = 0
+
+    while pos < len(data):
+        size = next(sizes)
+        blocks.append(data[pos : pos + size])
+        pos += size
+
+    return blocks
+
+
+def build_pipeline(specs):
+    pipeline = Pipeline()
+
+    for filterclass, kwargs in specs:
+        pipeline.addFilter(filterclass, **kwargs)
+
+    return pipeline
+
+
+class ChunkCollector:
+    # Pipeline sinks are weakly referenced, hence this class instead of a
+    # closure.
+
+    def __init__(self, keep=True):
+        self.keep = keep
+        self.chunks = []
+        self.count = 0
+
+    def sink(self, chunk):
+        self.count += 1
+
+        if self.keep:
+            self.chunks.append(chunk)
+
+
+def feed_blocks(pipeline, blocks):
+    for block in blocks:
+        pipeline.feedBytes(block)
+
+    # Flush out whatever is left pending, like a prompt.
+    pipeline.sweepPrompt()
+
+
+def capture_stream(specs, blocks):
+    # Returns the stream of chunks output by a pipeline made of the given
+    # filters. With no filter, that's the raw stream the pipeline feeds its
+    # first filter.
+
+    pipeline = build_pipeline(specs or [(BaseFilter, {})])
+    collector = ChunkCollector()
+    pipeline.addSink(collector.sink)
+
+    feed_blocks(pipeline, blocks)
+
+    return collector.chunks
+
+
+def time_chain(specs, blocks):
+    pipeline = build_pipeline(specs)
+    collector = ChunkCollector(keep=False)
+    pipeline.addSink(collector.sink)
+
+    start = time.perf_counter()
+    feed_blocks(pipeline, blocks)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, collector.count
+
+
+def count_chain_allocs(specs, blocks):
+    pipeline = build_pipeline(specs)
+    collector = ChunkCollector()
+    pipeline.addSink(collector.sink)
+
+    gc.collect()
+    before = sys.getallocatedblocks()
+    feed_blocks(pipeline, blocks)
+    after = sys.getallocatedblocks()
+
+    return (after - before) / max(1, len(collector.chunks))
+
+
+def make_filter(filterclass, kwargs, sink):
+    filter = filterclass(context=Pipeline(), **kwargs)
+    filter.setSink(sink)
+
+    return filter
+
+
+def time_filter(filterclass, kwargs, stream):
+    output = ChunkCollector(keep=False)
+    feed = make_filter(filterclass, kwargs, output.sink).feedChunk
+
+    start = time.perf_counter()
+    for chunk in stream:
+        feed(chunk)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, output.count
+
+
+def count_filter_allocs(filterclass, kwargs, stream):
+    output = []
+    feed = make_filter(filterclass, kwargs, output.append).feedChunk
+
+    gc.collect()
+    before = sys.getallocatedblocks()
+    for chunk in stream:
+        feed(chunk)
+    after = sys.getallocatedblocks()
+
+    return (after - before) / max(1, len(output))
+
+
+def find_stage(config, encoding):
+    # Returns the chain a filter is part of, and its position in it.
+
+    for chain in ("chain", "fused"):
+        for i, (filterclass, _) in enumerate(chain_specs(chain, encoding)):
+            if filterclass.__name__ == config:
+                return chain, i
+
+    raise ValueError("Unknown configuration: %s" % config)
+
+
+def run_benchmark(data, config, blocks, encoding, repeat):
+    if config in ("chain", "fused"):
+        specs = chain_specs(config, encoding)
+
+        def run():
+            return time_chain(specs, blocks)
+
+        def count_allocs():
+            return count_chain_allocs(specs, blocks)
+
+    else:
+        chain, i = find_stage(config, encoding)
+        specs = chain_specs(chain, encoding)
+        filterclass, kwargs = specs[i]
+        stream = capture_stream(specs[:i], blocks)
+
+        def run():
+            return time_filter(filterclass, kwargs, stream)
+
+        def count_allocs():
+            return count_filter_allocs(filterclass, kwargs, stream)
+
+    best = None
+
+    for _ in range(repeat):
+        elapsed, chunks = run()
+        best = elapsed if best is None else min(best, elapsed)
+
+    assert best is not None
+
+    return {
+        "seconds": best,
+        "mb_per_s": len(data) / best / 1e6,
+        "lines_per_s": data.count(b"\n") / best,
+        "chunks": chunks,
+        "allocs_per_chunk": count_allocs(),
+    }
+
+
+def run_scaling(data, config, encoding, repeat):
+    # Feeds the data whole, as a single packet, at each of the scaling
+    # factors, and returns the results by factor.
+
+    specs = chain_specs(config, encoding)
+    results = {}
+
+    for factor in SCALING_FACTORS:
+        blocks = [data * factor]
+        best = None
+
+        for _ in range(repeat):
+            elapsed, chunks = time_chain(specs, blocks)
+            best = elapsed if best is None else min(best, elapsed)
+
+        assert best is not None
+
+        results[factor] = {
+            "seconds": best,
+            "mb_per_s": len(blocks[0]) / best / 1e6,
+            "chunks": chunks,
+        }
+
+    return results
+
+
+def load_corpus(name, min_size):
+    # Returns the data of the corpus, and its packets if it's a recorded
+    # session.
+
+    path = name if os.path.exists(name) else os.path.join(DATA_DIR, name)
+
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            f.seek(0)
+            packets = [packet for _, packet in read_session(f)]
+            return b"".join(packets), packets
+
+        f.seek(0)
+        data = f.read()
+
+    # Small corpora are repeated, so the timings are long enough to be
+    # meaningful.
+    if data and len(data) < min_size:
+        data *= -(-min_size // len(data))
+
+    return data, None
+
+
+def compare(results, baseline, tolerance):
+    # Prints how each result compares to the baseline, and returns the number
+    # of regressions.
+
+    regressions = 0
+
+    print()
+    print("Compared to baseline (tolerance: %d%%):" % (tolerance * 100))
+
+    for key, result in results.items():
+        reference = baseline.get(key)
+
+        if reference is None:
+            print("  %-50s  new" % key)
+            continue
+
+        ratio = result["mb_per_s"] / reference["mb_per_s"]
+        verdict = ""
+
+        if ratio < 1 - tolerance:
+            verdict = "  REGRESSION"
+            regressions += 1
+
+        print("  %-50s  %6.2fx%s" % (key, ratio, verdict))
+
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of the Spyrit pipeline."
+    )
+    parser.add_argument(
+        "corpora",
+        nargs="*",
+        default=DEFAULT_CORPORA,
+        help="files to feed the pipeline, looked up in tests/data if needed",
+    )
+    parser.add_argument(
+        "--blocks",
+        default=",".join(DEFAULT_BLOCKS),
+        help="comma-separated block sizes, or min-max ranges of random sizes",
+    )
+    parser.add_argument(
+        "--configs",
+        default=",".join(all_configs()),
+        help="comma-separated chains and filters to benchmark",
+    )
+    parser.add_argument("--encoding", default="latin1")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--min-size",
+        type=int,
+        default=DEFAULT_MIN_SIZE,
+        help="repeat smaller corpora up to this size, in bytes",
+    )
+    parser.add_argument(
+        "--scaling",
+        action="store_true",
+        help="also feed each corpus whole at %s times its size"
+        % ", ".join(str(factor) for factor in SCALING_FACTORS),
+    )
+    parser.add_argument("--save", metavar="JSON", help="save results")
+    parser.add_argument("--compare", metavar="JSON", help="compare results")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="allowed throughput drop when comparing (default: 0.10)",
+    )
+
+    args = parser.parse_args(argv)
+
+    results = {}
+
+    print(
+        "%-50s %9s %11s %9s %12s"
+        % ("corpus/config/blocks", "MB/s", "lines/s", "chunks", "allocs/chunk")
+    )
+
+    for corpus in args.corpora:
+        data, packets = load_corpus(corpus, args.min_size)
+
+        blockspecs = args.blocks.split(",")
+
+        if packets is not None:
+            blockspecs.append("recorded")
+
+        for config in args.configs.split(","):
+            for blockspec in blockspecs:
+                if blockspec == "recorded":
+                    blocks = packets
+                else:
+                    blocks = split_blocks(data, blockspec)
+
+                key = "%s/%s/%s" % (os.path.basename(corpus), config, blockspec)
+                result = run_benchmark(
+                    data, config, blocks, args.encoding, args.repeat
+                )
+                results[key] = result
+
+                print(
+                    "%-50s %9.2f %11.0f %9d %12.2f"
+                    % (
+                        key,
+                        result["mb_per_s"],
+                        result["lines_per_s"],
+                        result["chunks"],
+                        result["allocs_per_chunk"],
+                    )
+                )
+
+    if args.scaling:
+        print()
+        print(
+            "%-50s %9s %9s %9s %9s"
+            % ("corpus/config/size", "MB", "seconds", "ms/MB", "vs 1x")
+        )
+
+        for corpus in args.corpora:
+            data, _ = load_corpus(corpus, args.min_size)
+
+            for config in args.configs.split(","):
+                if config not in ("chain", "fused"):
+                    continue
+
+                scaling = run_scaling(
+                    data, config, args.encoding, args.repeat
+                )
+                reference = scaling[SCALING_FACTORS[0]]["mb_per_s"]
+
+                for factor, result in scaling.items():
+                    key = "%s/%s/whole-%dx" % (
+                        os.path.basename(corpus),
+                        config,
+                        factor,
+                    )
+                    results[key] = result
+
+                    print(
+                        "%-50s %9.2f %9.3f %9.1f %9.2f"
+                        % (
+                            key,
+                            len(data) * factor / 1e6,
+                            result["seconds"],
+                            1e3 / result["mb_per_s"],
+                            reference / result["mb_per_s"],
+                        )
+                    )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "encoding": args.encoding,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+        if compare(results, baseline, args.tolerance):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""
+Measures how fast the triggers manager processes lines, depending on how many
+triggers it holds.
+
+The lines are synthetic MUD traffic, as served by tests/data/loadserver.py,
+without the ANSI codes. The triggers are a mix of smart and regex patterns.
+A few of them match lines of that traffic; most hold words that never occur
+in it, which is what most triggers look like to most lines.
+
+Each trigger highlights what it matches, so that the cost of the actions is
+counted as well.
+
+For each trigger count, this reports:
+
+- lines/s: lines processed per second;
+- µs/line: the time it takes to process one line;
+- matches: the number of matches found, which shouldn't depend on the way the
+  manager finds them.
+
+With --workers, the lines are also matched by pools of worker processes of
+the given sizes, in batches of --batch lines, as the triggers filter does with
+the lines of large packets, and each pool size gets its own line in the report,
+along with its speedup over matching in this process (0 workers). The speedup
+depends on the number of CPU cores, which is reported as well.
+
+Usage examples:
+
+    ./triggers_throughput.py
+    ./triggers_throughput.py --triggers 0,400 --lines 5000
+    ./triggers_throughput.py --triggers 1000 --workers 0,1,2,4
+"""
+
+
+import argparse
+import os
+import random
+import sys
+import time
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__) or os.curdir)
+DATA_DIR = os.path.normpath(os.path.join(THIS_DIR, os.path.pardir, "data"))
+SPYRIT_DIR = os.path.normpath(
+    os.path.join(THIS_DIR, os.path.pardir, os.path.pardir, "src")
+)
+
+sys.path.insert(0, SPYRIT_DIR)
+sys.path.insert(0, DATA_DIR)
+
+from Globals import FORMAT_PROPERTIES  # noqa: E402
+from loadserver import TrafficGenerator  # noqa: E402
+from MatchWorkers import MatchWorkerPool  # noqa: E402
+from pipeline.ChunkData import ChunkType  # noqa: E402
+from pipeline.TriggersFilter import MAX_PENDING_LINES  # noqa: E402
+from TriggersManager import HighlightAction  # noqa: E402
+from TriggersManager import TriggersManager  # noqa: E402
+
+
+DEFAULT_TRIGGERS = ["0", "50", "100", "400", "1000"]
+DEFAULT_LINES = 2000
+SEED = 1337
+
+# Triggers that match the synthetic traffic.
+MATCHING_TRIGGERS = [
+    ("[name] hits [target] with [weapon] for [number] damage.", "smart"),
+    ("[[channel]] [name]: %", "smart"),
+    ("You receive * gold coins from %.", "smart"),
+    (r"(?P<name>\w+) casts a spell at (?P<target>.+?)\.", "regex"),
+]
+
+# Templates for triggers that don't. The words get filled in with random
+# syllables.
+NONMATCHING_TEMPLATES = [
+    ("[player] {word}s you: [message]", "smart"),
+    ("You are {word}.", "smart"),
+    ("The {word} {word} arrives from the %.", "smart"),
+    ("* {word} * {word} *", "smart"),
+    (r"^\[(?P<channel>\w+)\] {word} (?P<who>\w+)$", "regex"),
+    (r"{word}(ed|s) (?:the|a) (\w+)", "regex"),
+    (r"\b{word}\b.*\b{word}\b", "regex"),
+]
+
+SYLLABLES = ["bra", "kon", "dil", "zu", "mor", "thi", "vek", "sal", "qua"]
+
+
+def make_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+
+
+def make_manager(count, matching, rng):
+    manager = TriggersManager()
+
+    specs = MATCHING_TRIGGERS[: min(count, matching)]
+
+    while len(specs) < count:
+        pattern, type = rng.choice(NONMATCHING_TEMPLATES)
+
+        while "{word}" in pattern:
+            pattern = pattern.replace("{word}", make_word(rng), 1)
+
+        specs.append((pattern, type))
+
+    # Spread the matching triggers among the others.
+    rng.shuffle(specs)
+
+    highlight = {"__line__": {FORMAT_PROPERTIES.BOLD: True}}
+
+    for i, (pattern, type) in enumerate(specs):
+        group = manager.findOrCreateTrigger("trigger%d" % i)
+        group.addMatch(manager.createMatch(pattern, type))
+        group.addAction(HighlightAction(highlight))
+
+    return manager
+
+
+def make_lines(count):
+    options = argparse.Namespace(
+        ansi=0, colors_256=0, telnet=0, prompt_every=0, encoding="utf-8"
+    )
+    generator = TrafficGenerator(options, random.Random(SEED))
+
+    return [generator.text().decode("utf-8") for _ in range(count)]
+
+
+def run(manager, lines):
+    matches = 0
+
+    start = time.perf_counter()
+
+    for line in lines:
+        chunkbuffer = [(ChunkType.TEXT, line)]
+        manager.performMatchingActions(line, chunkbuffer)
+        matches += len(chunkbuffer) > 1
+
+    return time.perf_counter() - start, matches
+
+
+def run_pool(manager, pool, lines, batch):
+    matches = 0
+
+    start = time.perf_counter()
+
+    for i in range(0, len(lines), batch):
+        batch_lines = lines[i : i + batch]
+
+        for line, found in zip(batch_lines, pool.findMatches(batch_lines)):
+            chunkbuffer = [(ChunkType.TEXT, line)]
+            manager.performActions(found, chunkbuffer)
+            matches += len(chunkbuffer) > 1
+
+    return time.perf_counter() - start, matches
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of the Spyrit triggers manager."
+    )
+    parser.add_argument(
+        "--triggers",
+        default=",".join(DEFAULT_TRIGGERS),
+        help="comma-separated trigger counts",
+    )
+    parser.add_argument("--lines", type=int, default=DEFAULT_LINES)
+    parser.add_argument(
+        "--matching",
+        type=int,
+        default=len(MATCHING_TRIGGERS),
+        help="how many of the triggers match the traffic (default: %d)"
+        % len(MATCHING_TRIGGERS),
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--workers",
+        default="0",
+        help="comma-separated worker process counts (default: 0)",
+    )
+    parser.add_argument("--batch", type=int, default=MAX_PENDING_LINES)
+
+    args = parser.parse_args(argv)
+
+    lines = make_lines(args.lines)
+
+    print("CPU cores: %d" % (os.cpu_count() or 1))
+    print(
+        "%-10s %8s %11s %9s %9s %8s"
+        % ("triggers", "workers", "lines/s", "µs/line", "matches", "speedup")
+    )
+
+    for count in args.triggers.split(","):
+        manager = make_manager(int(count), args.matching, random.Random(SEED))
+
+        reference = None
+
+        for workers in args.workers.split(","):
+            pool = None
+
+            if int(workers):
+                pool = MatchWorkerPool(manager, int(workers))
+
+                # Get the workers started before timing them.
+                if not pool.waitForWorkers():
+                    print("%-10s %8s failed to start" % (count, workers))
+                    continue
+
+            best = None
+
+            for _ in range(args.repeat):
+                # Don't let the lines of a run be found in the cache of the
+                # previous one.
+                manager.match_cache.clear()
+
+                if pool is None:
+                    elapsed, matches = run(manager, lines)
+
+                else:
+                    elapsed, matches = run_pool(
+                        manager, pool, lines, args.batch
+                    )
+
+                best = elapsed if best is None else min(best, elapsed)
+
+            if pool is not None:
+                pool.close()
+
+            assert best is not None
+
+            if int(workers) == 0:
+                reference = best
+
+            print(
+                "%-10s %8s %11.0f %9.1f %9d %8s"
+                % (
+                    count,
+                    workers,
+                    len(lines) / best,
+                    best / len(lines) * 1e6,
+                    matches,
+                    "%.2fx" % (reference / best) if reference else "-",
+                )
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
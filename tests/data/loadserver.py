@@ -0,0 +1,411 @@
+#!/usr/bin/python
+
+"""
+A local server that sends synthetic MUD traffic, for load testing the client.
+
+Each client that connects gets its own stream of generated lines, sent at the
+given rate, with the given density of ANSI color codes, telnet negotiations and
+prompts. Once a client is done, the server reports what it sent to it.
+
+For instance, to reproduce 500 lines/s of colorful raid spam, with a burst of
+2000 lines every 5 seconds:
+
+    ./loadserver.py --rate 500 --ansi 0.5 --256-colors 0.5 \\
+        --burst-lines 2000 --burst-interval 5
+
+Then connect the client to 127.0.0.1:8000.
+"""
+
+
+import argparse
+import json
+import os
+import random
+import select
+import socket
+import sys
+import threading
+import time
+
+DEFAULT_PORT = 8000
+
+IAC = 255
+SB, WILL, WONT, DO, DONT, SE = 250, 251, 252, 253, 254, 240
+TELNET_OPTIONS = [1, 3, 24, 25, 31, 201]  # ECHO SGA TTYPE EOR NAWS GMCP
+
+NAMES = ["Gareth", "Plett", "Daz", "Serríað", "Charli", "Mariusz", "Ellyll"]
+NAMES_UTF8 = ["Ωmega", "Łukasz", "Дмитрий"]
+TARGETS = ["the orc", "a cave troll", "the Dragon of Ærth", "a goblin"]
+WEAPONS = ["a longsword", "a fireball", "a rusty dagger", "a böwstring"]
+CHANNELS = ["raid", "ooc", "newbie", "clan"]
+CHATS = [
+    "heal me!",
+    "tank is down",
+    "ça va, tout le monde ?",
+    "pull in 5",
+    "LOL",
+    "who has the key?",
+]
+CHATS_UTF8 = ["→ follow me", "GG ✓", "über-loot ★"]
+
+TEMPLATES = [
+    "{name} hits {target} with {weapon} for {number} damage.",
+    "{target} misses {name}.",
+    "[{channel}] {name}: {chat}",
+    "{name} casts a spell at {target}. It deals {number} damage!",
+    "You receive {number} gold coins from {target}.",
+]
+
+
+class TrafficGenerator:
+    def __init__(self, options, rng):
+        self.options = options
+        self.rng = rng
+
+        self.names = NAMES[:]
+        self.chats = CHATS[:]
+
+        if options.encoding == "utf-8":
+            self.names += NAMES_UTF8
+            self.chats += CHATS_UTF8
+
+        self.lines_since_prompt = 0
+
+        self.counts = {
+            "lines": 0,
+            "bytes": 0,
+            "ansi_sequences": 0,
+            "256_color_sequences": 0,
+            "telnet_sequences": 0,
+            "escaped_iacs": 0,
+            "prompts": 0,
+            "bursts": 0,
+        }
+
+    def colorize(self, word):
+        if self.rng.random() >= self.options.ansi:
+            return word
+
+        self.counts["ansi_sequences"] += 2
+
+        if self.rng.random() < self.options.colors_256:
+            self.counts["256_color_sequences"] += 1
+            color = "\x1b[38;5;%dm" % self.rng.randrange(256)
+
+        else:
+            color = "\x1b[%d;3%dm" % (
+                self.rng.randint(0, 1),
+                self.rng.randint(1, 7),
+            )
+
+        return color + word + "\x1b[0m"
+
+    def text(self):
+        template = self.rng.choice(TEMPLATES)
+
+        line = template.format(
+            name=self.colorize(self.rng.choice(self.names)),
+            target=self.colorize(self.rng.choice(TARGETS)),
+            weapon=self.colorize(self.rng.choice(WEAPONS)),
+            number=self.colorize(str(self.rng.randint(1, 999))),
+            channel=self.colorize(self.rng.choice(CHANNELS)),
+            chat=self.rng.choice(self.chats),
+        )
+
+        return line.encode(self.options.encoding)
+
+    def telnet(self):
+        self.counts["telnet_sequences"] += 1
+        option = self.rng.choice(TELNET_OPTIONS)
+
+        if self.rng.random() < 0.2:
+            # A terminal type request subnegotiation.
+            return bytes([IAC, SB, 24, 1, IAC, SE])
+
+        command = self.rng.choice([WILL, WONT, DO, DONT])
+        return bytes([IAC, command, option])
+
+    def line(self):
+        data = self.text()
+
+        if self.options.encoding == "latin1" and self.rng.random() < 0.01:
+            # A literal 'ÿ', which must be escaped in telnet.
+            self.counts["escaped_iacs"] += 1
+            data += bytes([IAC, IAC])
+
+        if self.rng.random() < self.options.telnet:
+            data = self.telnet() + data
+
+        data += b"\r\n"
+        self.counts["lines"] += 1
+
+        self.lines_since_prompt += 1
+
+        if (
+            self.options.prompt_every
+            and self.lines_since_prompt >= self.options.prompt_every
+        ):
+            self.lines_since_prompt = 0
+            self.counts["prompts"] += 1
+            hp = self.rng.randint(1, 100)
+            data += self.colorize("HP: %d%%" % hp).encode("ascii") + b" > "
+
+        return data
+
+    def lines(self, count):
+        data = b"".join(self.line() for _ in range(count))
+        self.counts["bytes"] += len(data)
+
+        return data
+
+
+def split_sends(data, spec, rng):
+    # Yields pieces of data of the given size range, like a slow server would
+    # send them.
+
+    if not spec:
+        yield data
+        return
+
+    low, _, high = spec.partition("-")
+    low = int(low)
+    high = int(high or low)
+
+    while data:
+        size = rng.randint(low, high)
+        yield data[:size]
+        data = data[size:]
+
+
+def serve_client(clientsocket, address, number, options, reports):
+    rng = random.Random(options.seed + number)
+    generator = TrafficGenerator(options, rng)
+
+    dump = None
+    if options.dump:
+        dump = open(os.path.join(options.dump, "client-%d.bin" % number), "wb")
+
+    received = 0
+    steady_lines = 0  # Lines sent at the steady rate, i.e. not in bursts.
+    max_lag = 0.0  # s
+    start = time.monotonic()
+    next_burst = start + options.burst_interval
+
+    try:
+        while True:
+            now = time.monotonic()
+            elapsed = now - start
+
+            if options.duration and elapsed >= options.duration:
+                break
+
+            if options.lines and generator.counts["lines"] >= options.lines:
+                break
+
+            if options.rate:
+                due = int(options.rate * elapsed) - steady_lines
+                max_lag = max(max_lag, due / options.rate)
+                steady_lines += due
+
+            else:
+                due = 100  # As fast as we can.
+
+            if (
+                options.burst_lines
+                and options.burst_interval
+                and now >= next_burst
+            ):
+                due += options.burst_lines
+                generator.counts["bursts"] += 1
+                next_burst += options.burst_interval
+
+            if options.lines:
+                due = min(due, options.lines - generator.counts["lines"])
+
+            if due > 0:
+                data = generator.lines(due)
+
+                if dump:
+                    dump.write(data)
+
+                for piece in split_sends(data, options.split, rng):
+                    clientsocket.sendall(piece)
+
+            readable, _, _ = select.select([clientsocket], [], [], 0)
+
+            if readable:
+                msg = clientsocket.recv(4096)
+
+                if not msg:
+                    break  # Client disconnected.
+
+                received += len(msg)
+
+            if options.rate:
+                time.sleep(options.tick)
+
+    except OSError:
+        pass
+
+    finally:
+        duration = time.monotonic() - start
+
+        try:
+            clientsocket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        clientsocket.close()
+
+        if dump:
+            dump.close()
+
+    report = dict(generator.counts)
+    report.update(
+        client=number,
+        address="%s:%d" % address,
+        duration=round(duration, 3),
+        lines_per_second=round(report["lines"] / max(duration, 1e-9), 1),
+        max_lag=round(max_lag, 3),
+        received_bytes=received,
+    )
+    reports.append(report)
+
+    print(
+        "Client %(client)d (%(address)s): %(lines)d lines, %(bytes)d bytes in"
+        " %(duration).1fs (%(lines_per_second).1f lines/s, max lag"
+        " %(max_lag).3fs); %(ansi_sequences)d ANSI sequences"
+        " (%(256_color_sequences)d 256-color), %(telnet_sequences)d telnet"
+        " sequences, %(escaped_iacs)d escaped IACs, %(prompts)d prompts,"
+        " %(bursts)d bursts; received %(received_bytes)d bytes." % report
+    )
+    sys.stdout.flush()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Serve synthetic MUD traffic for load testing."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=50,
+        help="lines per second per client (0: as fast as possible)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=10,
+        help="seconds of traffic per client (0: until disconnected)",
+    )
+    parser.add_argument(
+        "--lines", type=int, default=0, help="lines per client (0: no limit)"
+    )
+    parser.add_argument(
+        "--ansi", type=float, default=0.3, help="ratio of colored words"
+    )
+    parser.add_argument(
+        "--256-colors",
+        dest="colors_256",
+        type=float,
+        default=0.0,
+        help="ratio of colors that use the 256 color palette",
+    )
+    parser.add_argument(
+        "--telnet",
+        type=float,
+        default=0.01,
+        help="ratio of lines preceded by a telnet negotiation",
+    )
+    parser.add_argument(
+        "--prompt-every",
+        type=int,
+        default=20,
+        help="send a prompt every that many lines (0: never)",
+    )
+    parser.add_argument(
+        "--encoding", choices=["utf-8", "latin1"], default="utf-8"
+    )
+    parser.add_argument(
+        "--burst-lines", type=int, default=0, help="lines sent per burst"
+    )
+    parser.add_argument(
+        "--burst-interval",
+        type=float,
+        default=0,
+        help="seconds between bursts",
+    )
+    parser.add_argument(
+        "--split",
+        default="",
+        help="send data in pieces of this size or min-max range, e.g. 1-16",
+    )
+    parser.add_argument(
+        "--tick", type=float, default=0.01, help="seconds between sends"
+    )
+    parser.add_argument(
+        "--clients",
+        type=int,
+        default=0,
+        help="stop after serving that many clients (0: serve forever)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--dump", metavar="DIR", help="save the data sent to each client"
+    )
+    parser.add_argument(
+        "--report", metavar="JSON", help="save the per-client reports"
+    )
+
+    options = parser.parse_args(argv)
+
+    s = socket.socket()
+
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    s.bind((options.host, options.port))
+    s.listen(5)
+
+    print("Running on port %d. Interrupt to stop the server." % options.port)
+    sys.stdout.flush()
+
+    reports = []
+    threads = []
+
+    try:
+        while not options.clients or len(threads) < options.clients:
+            clientsocket, address = s.accept()
+
+            thread = threading.Thread(
+                target=serve_client,
+                args=(
+                    clientsocket,
+                    address,
+                    len(threads) + 1,
+                    options,
+                    reports,
+                ),
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+    except KeyboardInterrupt:
+        pass
+
+    s.close()
+
+    if options.report:
+        with open(options.report, "w") as f:
+            json.dump(sorted(reports, key=lambda r: r["client"]), f, indent=2)
+
+    print("Server stopped.")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])